@@ -1,67 +1,326 @@
 from fastapi import FastAPI, BackgroundTasks, HTTPException, Form, Request, Depends
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from pydantic import BaseModel, AfterValidator
 import asyncio
 import urllib.parse
 import cloudscraper
-import random
 import logging
 from bs4 import BeautifulSoup
-from typing import List, Dict, Optional
-from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Annotated
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Alignment
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill, Alignment, NamedStyle
+from openpyxl.utils import get_column_letter
 import datetime
 import os
 import uuid
 import re
 import time
+import queue
+from collections import deque
+import threading
 import sqlite3
+import aiohttp
+from yarl import URL
 import jwt
 import bcrypt
 import json
+import csv
+import io
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
 from datetime import datetime, timedelta
+from contextlib import asynccontextmanager, contextmanager
+from characteristics import CHARS_PARSERS
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-app = FastAPI()
+class MonitoredThreadPool(ThreadPoolExecutor):
+    """ThreadPoolExecutor з лічильниками для моніторингу: задачі в черзі, зайняті й завершені"""
+
+    def __init__(self, max_workers, name):
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self._stats_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._stats_lock:
+            self.queued += 1
+
+        def run():
+            with self._stats_lock:
+                self.queued -= 1
+                self.active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        def forget_cancelled(future):
+            if future.cancelled():
+                with self._stats_lock:
+                    self.queued -= 1
+
+        future = super().submit(run)
+        future.add_done_callback(forget_cancelled)
+        return future
+
+    def stats(self):
+        return {
+            'max_workers': self._max_workers,
+            'queued': self.queued,
+            'active': self.active,
+            'completed': self.completed,
+        }
+
+io_executor = None
+selenium_executor = None
+
+@asynccontextmanager
+async def lifespan(app):
+    """Спільні ресурси застосунку.
+
+    Пул парсингу стартує першим (fork до появи потоків браузерів), далі спільні пули потоків:
+    io_executor стає executor'ом за замовчуванням для asyncio.to_thread, selenium_executor
+    обслуговує Selenium усіх задач. Зупинка — у зворотному порядку.
+    """
+    global io_executor, selenium_executor
+    await start_parse_pool()
+    io_executor = MonitoredThreadPool(IO_WORKERS, "io")
+    asyncio.get_running_loop().set_default_executor(io_executor)
+    selenium_executor = MonitoredThreadPool(SELENIUM_WORKERS, "selenium")
+    await warm_up_selenium_pool()
+    await favorites_monitor.start()
+    await job_manager.start()
+    try:
+        yield
+    finally:
+        await job_manager.stop()
+        await favorites_monitor.stop()
+        await http_client.close()
+        await asyncio.to_thread(selenium_executor.shutdown, True, cancel_futures=True)
+        await close_selenium_pool()
+        await stop_parse_pool()
+        io_executor.shutdown(wait=True, cancel_futures=True)
+
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-prod")
 ALGORITHM = "HS256"
+DB_PATH = os.getenv("DB_PATH", "users.db")
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", 5000))  # мс
 
 os.makedirs("downloads", exist_ok=True)
 
 MAX_PAGES = 1000
 
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 100))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", 20))
+
+RATE_INITIAL_CONCURRENCY = int(os.getenv("RATE_INITIAL_CONCURRENCY", 4))
+RATE_MAX_CONCURRENCY = int(os.getenv("RATE_MAX_CONCURRENCY", HTTP_PER_HOST_LIMIT))
+RATE_INITIAL_INTERVAL = float(os.getenv("RATE_INITIAL_INTERVAL", 0.2))
+RATE_MIN_INTERVAL = float(os.getenv("RATE_MIN_INTERVAL", 0.02))
+RATE_MAX_INTERVAL = float(os.getenv("RATE_MAX_INTERVAL", 10))
+RATE_INTERVAL_STEP = 0.01
+RATE_LATENCY_TARGET = float(os.getenv("RATE_LATENCY_TARGET", 3))
+
+SELENIUM_POOL_SIZE = int(os.getenv("SELENIUM_POOL_SIZE", 3))
+SELENIUM_DRIVER_MAX_PAGES = int(os.getenv("SELENIUM_DRIVER_MAX_PAGES", 50))
+SELENIUM_POOL_WARMUP = os.getenv("SELENIUM_POOL_WARMUP", "0") == "1"
+SELENIUM_PRODUCT_BUDGET = float(os.getenv("SELENIUM_PRODUCT_BUDGET", 25))
+SELENIUM_ABSENT_GRACE = float(os.getenv("SELENIUM_ABSENT_GRACE", 1.5))
+SELENIUM_SCROLL_STEP_WAIT = 0.3
+
+WISHLIST_BATCH_SIZE = 60
+LISTING_CONCURRENCY = int(os.getenv("LISTING_CONCURRENCY", 5))
+DETAILS_BATCH_SIZE = 60
+DETAILS_CONCURRENCY = int(os.getenv("DETAILS_CONCURRENCY", 2))
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", 10))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 120))
+ENRICH_CALL_TIMEOUT = float(os.getenv("ENRICH_CALL_TIMEOUT", 30))
+SELENIUM_CALL_TIMEOUT = float(os.getenv("SELENIUM_CALL_TIMEOUT", 180))
+
+def available_cpus():
+    """CPU, доступні процесу: affinity, обмежена квотою cgroup v2 (cpu.max) у контейнері"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+EXTRACTION_ENGINE = os.getenv("EXTRACTION_ENGINE", "selenium")
+CHARS_PARSER = os.getenv("CHARS_PARSER", "fast")  # fast | bs4
+PARSE_PROCESSES_MAX = 2  # кожен процес пулу — копія застосунку в пам'яті
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", min(available_cpus(), PARSE_PROCESSES_MAX)))  # 0/1 — парсинг у поточному потоці
+PARSE_POOL_MIN_PRODUCTS = int(os.getenv("PARSE_POOL_MIN_PRODUCTS", 30))
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "xlsx")  # xlsx | csv | jsonl | parquet
+PARQUET_ROW_GROUP_SIZE = int(os.getenv("PARQUET_ROW_GROUP_SIZE", 5000))
+
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache.db")
+CACHE_SQL_CHUNK = 500
+DETAILS_CACHE_TTL = int(os.getenv("DETAILS_CACHE_TTL", 900))
+DETAILS_CACHE_MAX_ENTRIES = int(os.getenv("DETAILS_CACHE_MAX_ENTRIES", 50000))
+CHARS_CACHE_TTL = int(os.getenv("CHARS_CACHE_TTL", 7 * 24 * 3600))
+CHARS_CACHE_MAX_ENTRIES = int(os.getenv("CHARS_CACHE_MAX_ENTRIES", 100000))
+DELIVERY_CITY_ID = os.getenv("DELIVERY_CITY_ID", "b205dde2-2e2e-4eb9-aef2-a67c82bbdf27")  # Київ
+DELIVERY_PRICE_BAND = int(os.getenv("DELIVERY_PRICE_BAND", 50))
+DELIVERY_CACHE_TTL = int(os.getenv("DELIVERY_CACHE_TTL", 6 * 3600))
+DELIVERY_CACHE_MAX_ENTRIES = int(os.getenv("DELIVERY_CACHE_MAX_ENTRIES", 100000))
+SNAPSHOT_TTL = int(os.getenv("SNAPSHOT_TTL", 3 * 24 * 3600))
+SNAPSHOT_MAX_ENTRIES = int(os.getenv("SNAPSHOT_MAX_ENTRIES", 100000))
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+IO_WORKERS = int(os.getenv("IO_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+SELENIUM_WORKERS = int(os.getenv("SELENIUM_WORKERS", SELENIUM_POOL_SIZE))
+ADMISSION_JOB_MIN_FREE_MB = int(os.getenv("ADMISSION_JOB_MIN_FREE_MB", 0))  # 0 — без перевірки пам'яті
+ADMISSION_BROWSER_MIN_FREE_MB = int(os.getenv("ADMISSION_BROWSER_MIN_FREE_MB", 0))
+ADMISSION_POLL_INTERVAL = 2
+JOB_PROGRESS_FLUSH_INTERVAL = 1.0
+JOB_EVENTS_QUEUE_SIZE = 100
+JOB_EVENTS_KEEPALIVE = 15
+JOB_CHECKPOINT_BATCH = int(os.getenv("JOB_CHECKPOINT_BATCH", 20))
+JOB_CHECKPOINT_RETENTION_DAYS = int(os.getenv("JOB_CHECKPOINT_RETENTION_DAYS", 7))
+MONITOR_TICK = int(os.getenv("MONITOR_TICK", 60))
+MONITOR_MIN_INTERVAL = int(os.getenv("MONITOR_MIN_INTERVAL", 5))  # хвилин
+HISTORY_FETCH_SIZE = 1000
+
+def normalize_city_id(value):
+    """city_id для get-deliveries: лише UUID, бо значення потрапляє в URL і ключ кешу доставки"""
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        raise ValueError(f"Некоректний delivery_city_id: {value}")
+
+DeliveryCityId = Annotated[str, AfterValidator(normalize_city_id)]
+
 class SearchRequest(BaseModel):
     url: str
     include_chars: bool = True
     max_pages: int = 2
+    extraction_engine: str = EXTRACTION_ENGINE
+    delivery_city_id: DeliveryCityId = DELIVERY_CITY_ID
+    output_format: str = OUTPUT_FORMAT
 
 class SellerRequest(BaseModel):
     seller_name: str
     include_chars: bool = True
     max_pages: int = 2
+    extraction_engine: str = EXTRACTION_ENGINE
+    delivery_city_id: DeliveryCityId = DELIVERY_CITY_ID
+    output_format: str = OUTPUT_FORMAT
+
+class MonitorRequest(BaseModel):
+    interval_minutes: int
 
 class FavoriteRequest(BaseModel):
     name: str
     urls: List[str]
     include_chars: bool = True
+    extraction_engine: str = EXTRACTION_ENGINE
+    delivery_city_id: DeliveryCityId = DELIVERY_CITY_ID
+
+class Database:
+    """Доступ до users.db: одне з'єднання на потік (WAL, busy_timeout), рядки — sqlite3.Row.
+
+    Методи синхронні; з event loop їх викликають через await db.run(...), тож запити виконуються
+    в потоках io_executor і не зупиняють парсинг.
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def connect(self, check_same_thread=True):
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT / 1000, check_same_thread=check_same_thread)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+        return conn
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """З'єднання потоку з транзакцією: commit при успіху, rollback при помилці"""
+        conn = self.connection()
+        with conn:
+            yield conn
+
+    def fetchone(self, query, args=()):
+        return self.connection().execute(query, args).fetchone()
+
+    def fetchall(self, query, args=()):
+        return self.connection().execute(query, args).fetchall()
+
+    def execute(self, query, args=()):
+        with self.transaction() as conn:
+            return conn.execute(query, args).rowcount
+
+    def executemany(self, query, rows):
+        with self.transaction() as conn:
+            conn.executemany(query, rows)
+
+    async def run(self, func, *args):
+        return await asyncio.to_thread(func, *args)
+
+db = Database()
+
+def add_missing_columns(c, table, columns):
+    """Міграція існуючих баз: додає колонки, яких ще немає в таблиці"""
+    c.execute(f"PRAGMA table_info({table})")
+    existing = [column[1] for column in c.fetchall()]
+    for name, definition in columns.items():
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
 
 def init_db():
-    conn = sqlite3.connect("users.db")
+    conn = db.connect()
     c = conn.cursor()
     c.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password_hash TEXT, status TEXT DEFAULT 'pending')")
     c.execute("CREATE TABLE IF NOT EXISTS favorites (id INTEGER PRIMARY KEY, username TEXT, name TEXT, urls TEXT, created_at TEXT)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_favorites_username ON favorites (username)")
+    add_missing_columns(c, 'favorites', {'delivery_city_id': 'TEXT', 'monitor_interval': 'INTEGER DEFAULT 0', 'monitor_last_run': 'TEXT'})
+    c.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, username TEXT, kind TEXT, params TEXT, state TEXT, processed INTEGER DEFAULT 0, total INTEGER DEFAULT 0, filename TEXT, error TEXT, created_at TEXT, updated_at TEXT)")
+    add_missing_columns(c, 'jobs', {'reenriched': 'INTEGER DEFAULT 0', 'reused': 'INTEGER DEFAULT 0'})
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_favorites_monitor ON favorites (monitor_interval) WHERE monitor_interval > 0")
+    c.execute("CREATE TABLE IF NOT EXISTS price_history (id INTEGER PRIMARY KEY, favorite_id INTEGER, product_id INTEGER, checked_at TEXT, price REAL, old_price REAL, sell_status TEXT, seller TEXT, comments_amount INTEGER, wishlist_count INTEGER)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_price_history_favorite ON price_history (favorite_id, checked_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_price_history_product ON price_history (product_id, checked_at)")
+    c.execute("CREATE TABLE IF NOT EXISTS job_pages (job_id TEXT, page INTEGER, product_ids TEXT, PRIMARY KEY (job_id, page))")
+    c.execute("CREATE TABLE IF NOT EXISTS job_products (job_id TEXT, product_id TEXT, product TEXT, PRIMARY KEY (job_id, product_id))")
     c.execute("SELECT id FROM users WHERE username=?", ("admin1",))
     if not c.fetchone():
         pw_hash = bcrypt.hashpw("admin33".encode(), bcrypt.gensalt())
@@ -92,11 +351,7 @@ async def get_current_user(request: Request) -> Optional[Dict[str, str]]:
         username = payload.get("sub")
         if username is None:
             return None
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT status FROM users WHERE username=?", (username,))
-        row = c.fetchone()
-        conn.close()
+        row = await db.run(db.fetchone, "SELECT status FROM users WHERE username=?", (username,))
         if row and row[0] in ['accepted', 'admin']:
             return {'username': username, 'status': row[0]}
         return None
@@ -118,6 +373,222 @@ HEADERS = {
     'Cache-Control': 'max-age=0',
 }
 
+class HttpStatusError(Exception):
+    def __init__(self, status_code, url):
+        super().__init__(f"HTTP {status_code} для {url}")
+        self.status_code = status_code
+        self.url = url
+
+class HttpResponse:
+    """Відповідь з інтерфейсом як у requests: status_code, headers, text, json(), raise_for_status()"""
+
+    def __init__(self, url, status_code, headers, text):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HttpStatusError(self.status_code, self.url)
+
+class HostRateController:
+    """AIMD-регулятор запитів до одного хоста.
+
+    Тримає ліміт одночасних запитів і мінімальний інтервал між їх стартами. Швидкі успішні
+    відповіді поступово піднімають ліміт (+1) і зменшують інтервал; 429/403, таймаути й
+    помилки з'єднання вдвічі зменшують ліміт і вдвічі збільшують інтервал (з урахуванням Retry-After).
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.limit = min(RATE_INITIAL_CONCURRENCY, RATE_MAX_CONCURRENCY)
+        self.interval = RATE_INITIAL_INTERVAL
+        self.in_flight = 0
+        self.throttled = 0
+        self.requests = 0
+        self._successes = 0
+        self._next_slot = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            now = time.monotonic()
+            start = max(now, self._next_slot)
+            self._next_slot = start + self.interval
+        try:
+            if start > now:
+                await asyncio.sleep(start - now)
+        except BaseException:
+            await self.release_slot()
+            raise
+
+    async def release_slot(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    async def release(self, status_code, latency, retry_after=None):
+        async with self._cond:
+            self.in_flight -= 1
+            self.requests += 1
+            if status_code is None or status_code in (403, 429):
+                self.throttled += 1
+                self._successes = 0
+                self.limit = max(1, self.limit // 2)
+                self.interval = min(RATE_MAX_INTERVAL, max(self.interval * 2, RATE_INTERVAL_STEP))
+                if retry_after:
+                    self._next_slot = max(self._next_slot, time.monotonic() + retry_after)
+                logging.warning(f"🐢 {self.host}: {status_code or 'помилка з’єднання'}, ліміт {self.limit}, інтервал {self.interval:.2f}с")
+            elif latency > RATE_LATENCY_TARGET:
+                self._successes = 0
+                self.limit = max(1, self.limit - 1)
+                self.interval = min(RATE_MAX_INTERVAL, self.interval + RATE_INTERVAL_STEP)
+            else:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self._successes = 0
+                    self.limit = min(RATE_MAX_CONCURRENCY, self.limit + 1)
+                self.interval = max(RATE_MIN_INTERVAL, self.interval - RATE_INTERVAL_STEP)
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'interval': round(self.interval, 3),
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'throttled': self.throttled,
+        }
+
+class RateController:
+    """Спільні для всього процесу регулятори, по одному на хост"""
+
+    def __init__(self):
+        self._hosts = {}
+
+    def for_url(self, url):
+        host = urllib.parse.urlparse(url).hostname or ''
+        controller = self._hosts.get(host)
+        if controller is None:
+            controller = self._hosts[host] = HostRateController(host)
+        return controller
+
+    def stats(self):
+        return {host: controller.stats() for host, controller in self._hosts.items()}
+
+rate_controller = RateController()
+
+def _retry_after_seconds(headers):
+    try:
+        return float(headers.get('Retry-After', ''))
+    except (TypeError, ValueError):
+        return None
+
+class RozetkaHttpClient:
+    """Асинхронний HTTP-клієнт з пулом keep-alive з'єднань, спільний для всіх запитів до Rozetka.
+
+    Cloudflare-челендж (403/503 від cloudflare) проходить через cloudscraper у потоці,
+    після чого отримані cookies переносяться в aiohttp-сесію.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, per_host_limit=HTTP_PER_HOST_LIMIT):
+        self.pool_size = pool_size
+        self.per_host_limit = per_host_limit
+        self._session = None
+        self._scraper = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.per_host_limit,
+                ttl_dns_cache=300,
+                keepalive_timeout=30,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, headers=HEADERS)
+        return self._session
+
+    def _get_scraper(self):
+        if self._scraper is None:
+            self._scraper = cloudscraper.create_scraper()
+            self._scraper.headers.update(HEADERS)
+        return self._scraper
+
+    @staticmethod
+    def _is_cloudflare_challenge(status_code, headers):
+        return status_code in (403, 503) and (
+            headers.get('Server', '').lower() == 'cloudflare' or 'cf-ray' in headers
+        )
+
+    def _scraper_get(self, url, headers, timeout):
+        scraper = self._get_scraper()
+        response = scraper.get(url, headers=headers, timeout=timeout)
+        return HttpResponse(url, response.status_code, response.headers, response.text)
+
+    async def get(self, url, headers=None, timeout=15):
+        controller = rate_controller.for_url(url)
+        await controller.acquire()
+        started = time.monotonic()
+        try:
+            session = self._get_session()
+            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                text = await response.text(errors='replace')
+                result = HttpResponse(url, response.status, response.headers, text)
+
+            if self._is_cloudflare_challenge(result.status_code, result.headers):
+                logging.warning(f"Cloudflare-челендж ({result.status_code}), повтор через cloudscraper: {url}")
+                result = await asyncio.to_thread(self._scraper_get, url, headers, timeout)
+                if result.status_code < 400:
+                    session.cookie_jar.update_cookies(
+                        self._get_scraper().cookies.get_dict(),
+                        response_url=URL(url),
+                    )
+        except asyncio.CancelledError:
+            await controller.release_slot()
+            raise
+        except Exception:
+            await controller.release(None, time.monotonic() - started)
+            raise
+        await controller.release(result.status_code, time.monotonic() - started, _retry_after_seconds(result.headers))
+        return result
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self._scraper is not None:
+            self._scraper.close()
+
+http_client = RozetkaHttpClient()
+
+parse_executor = None
+
+async def start_parse_pool():
+    """Пул процесів для розбору HTML; стартує до Selenium, щоб fork не копіював потоки браузерів"""
+    global parse_executor
+    if PARSE_PROCESSES > 1:
+        parse_executor = ProcessPoolExecutor(max_workers=PARSE_PROCESSES)
+        await asyncio.get_running_loop().run_in_executor(parse_executor, os.getpid)
+        logging.info(f"Пул парсингу: {PARSE_PROCESSES} процесів")
+
+async def stop_parse_pool():
+    if parse_executor is not None:
+        await asyncio.to_thread(parse_executor.shutdown, True, cancel_futures=True)
+
+async def run_parse(func, offload, *args):
+    """Розбір HTML у пулі процесів; без пулу або для дрібних задач (offload=False) — у поточному потоці"""
+    if offload and parse_executor is not None:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(parse_executor, func, *args)
+        except BrokenProcessPool as e:
+            logging.error(f"Пул парсингу недоступний, парсимо в потоці: {e}")
+    return func(*args)
+
 def create_selenium_driver():
     """Создание Selenium WebDriver оптимизированного для Railway"""
     chrome_options = Options()
@@ -171,7 +642,7 @@ def create_selenium_driver():
         
 
         driver.set_page_load_timeout(30)
-        driver.implicitly_wait(10)
+        driver.implicitly_wait(0)
         
         # Скрытие признаков автоматизации
         driver.execute_script(
@@ -194,45 +665,277 @@ def create_selenium_driver():
         logging.error(traceback.format_exc())
         raise
 
-def wait_for_content_load(driver, timeout=30):
-    logging.info("⏳ [Selenium] Очікування загрузки контенту...")
-    
-    for i in range(timeout):
-        time.sleep(1)
+def read_mem_available_mb():
+    """MemAvailable з /proc/meminfo у МБ; None, якщо прочитати не вдалося (не Linux)"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+class AdmissionController:
+    """Допуск нових задач і браузерів з огляду на вільну пам'ять.
+
+    Кількість задач обмежує JobManager (JOB_WORKERS), браузерів — пул Selenium (SELENIUM_POOL_SIZE).
+    Додатково задача стартує лише при MemAvailable >= ADMISSION_JOB_MIN_FREE_MB, а новий Chrome
+    запускається лише при MemAvailable >= ADMISSION_BROWSER_MIN_FREE_MB, інакше чекають. Перша задача
+    і перший браузер допускаються завжди, щоб система не зависла. Поріг 0 вимикає перевірку.
+    """
+
+    def __init__(self, job_min_free_mb=ADMISSION_JOB_MIN_FREE_MB, browser_min_free_mb=ADMISSION_BROWSER_MIN_FREE_MB):
+        self.job_min_free_mb = job_min_free_mb
+        self.browser_min_free_mb = browser_min_free_mb
+        self.deferred_jobs = 0
+        self.deferred_browsers = 0
+
+    @staticmethod
+    def _memory_ok(min_free_mb):
+        if not min_free_mb:
+            return True
+        available = read_mem_available_mb()
+        return available is None or available >= min_free_mb
+
+    async def admit_job(self, running_jobs):
+        """Чекає, поки пам'яті вистачить на ще одну задачу; running_jobs — функція з поточною кількістю"""
+        deferred = False
+        while running_jobs() > 0 and not self._memory_ok(self.job_min_free_mb):
+            if not deferred:
+                deferred = True
+                self.deferred_jobs += 1
+                logging.warning(f"Мало пам'яті ({read_mem_available_mb()} МБ), старт задачі відкладено")
+            await asyncio.sleep(ADMISSION_POLL_INTERVAL)
+
+    def browser_allowed(self, alive_browsers):
+        return alive_browsers == 0 or self._memory_ok(self.browser_min_free_mb)
+
+    def defer_browser(self, alive_browsers):
+        """Облік одного відкладеного запуску браузера (раз на виклик acquire, а не на кожне опитування)"""
+        self.deferred_browsers += 1
+        logging.info(f"[Selenium] Мало пам'яті для нового браузера, чекаємо вільний драйвер ({alive_browsers} запущено)")
+
+    def stats(self):
+        return {
+            'mem_available_mb': read_mem_available_mb(),
+            'job_min_free_mb': self.job_min_free_mb,
+            'browser_min_free_mb': self.browser_min_free_mb,
+            'deferred_jobs': self.deferred_jobs,
+            'deferred_browsers': self.deferred_browsers,
+        }
+
+admission = AdmissionController()
+
+class SeleniumDriverPool:
+    """Обмежений пул прогрітих Chrome-драйверів.
+
+    Драйвер видається через acquire() і повертається через release(). Між товарами
+    стан скидається (зайві вкладки, cookies, storage), а після max_pages сторінок
+    або падіння браузера драйвер закривається і при наступному запиті створюється новий.
+    """
+
+    def __init__(self, size=SELENIUM_POOL_SIZE, max_pages=SELENIUM_DRIVER_MAX_PAGES):
+        self.size = size
+        self.max_pages = max_pages
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._pages = {}
+        self._lock = threading.Lock()
+        self.waiting = 0
+
+    def warm_up(self):
+        for _ in range(self.size - self._idle.qsize()):
+            driver = create_selenium_driver()
+            with self._lock:
+                self._pages[id(driver)] = 0
+            self._idle.put(driver)
+        logging.info(f"Пул Selenium прогріто: {self._idle.qsize()} драйверів")
+
+    def acquire(self):
+        with self._lock:
+            self.waiting += 1
+        try:
+            self._slots.acquire()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        deferred = False
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                alive = len(self._pages)
+            if admission.browser_allowed(alive):
+                break
+            if not deferred:
+                deferred = True
+                admission.defer_browser(alive)
+            try:
+                return self._idle.get(timeout=ADMISSION_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        try:
+            driver = create_selenium_driver()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pages[id(driver)] = 0
+        return driver
+
+    def release(self, driver, broken=False):
+        try:
+            with self._lock:
+                pages = self._pages.get(id(driver), 0) + 1
+                self._pages[id(driver)] = pages
+            if broken or pages >= self.max_pages or not self._reset(driver):
+                reason = 'падіння браузера' if broken else f'{pages} сторінок'
+                logging.info(f"♻️ [Selenium] Перезапуск драйвера ({reason})")
+                self._discard(driver)
+            else:
+                self._idle.put(driver)
+        finally:
+            self._slots.release()
+
+    def _reset(self, driver):
         try:
-            driver.find_element(By.CSS_SELECTOR, "rz-slider-placeholder")
-            if i % 5 == 0:
-                logging.info(f"⏳ Placeholder присутствує ({i+1}/{timeout} сек)")
-        except NoSuchElementException:
-            logging.info(f"✓ Placeholder ісчез після {i+1} сек")
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            try:
+                driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+            except WebDriverException:
+                pass
+            driver.delete_all_cookies()
+            driver.get("about:blank")
             return True
-    
-    logging.info("⚠️ Placeholder не ісчез, провіряєм наличіє li елементів...")
+        except Exception as e:
+            logging.warning(f"⚠️ [Selenium] Не вдалося скинути стан драйвера: {e}")
+            return False
+
+    def _discard(self, driver):
+        with self._lock:
+            self._pages.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+
+    def stats(self):
+        with self._lock:
+            alive = len(self._pages)
+        idle = self._idle.qsize()
+        return {'size': self.size, 'alive': alive, 'idle': idle, 'in_use': alive - idle, 'waiting': self.waiting}
+
+selenium_pool = SeleniumDriverPool()
+
+async def warm_up_selenium_pool():
+    if SELENIUM_POOL_WARMUP:
+        await asyncio.to_thread(selenium_pool.warm_up)
+
+async def close_selenium_pool():
+    await asyncio.to_thread(selenium_pool.close)
+
+class PhaseTimer:
+    """Замір часу по фазах парсингу одного товару з загальним бюджетом часу"""
+
+    def __init__(self, product_id, budget=SELENIUM_PRODUCT_BUDGET):
+        self.product_id = product_id
+        self.budget = budget
+        self.created = self.started = time.monotonic()
+        self._last = self.started
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.monotonic()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def restart_budget(self):
+        self.started = time.monotonic()
+
+    def remaining(self, cap=None):
+        left = max(0.0, self.budget - (time.monotonic() - self.started))
+        return min(left, cap) if cap is not None else left
+
+    def log(self):
+        total = time.monotonic() - self.created
+        phases = ', '.join(f"{name} {seconds:.2f}с" for name, seconds in self.phases)
+        logging.info(f"⏱ [Selenium] Товар {self.product_id}: {phases} | всього {total:.2f}с з {self.budget:.0f}с")
+
+def _find_first(driver, selectors):
+    for selector in selectors:
+        elements = driver.find_elements(By.CSS_SELECTOR, selector)
+        if elements:
+            return elements[0]
+    return False
+
+def wait_for_any(driver, selectors, timeout):
+    """Чекає появи першого з селекторів; повертає елемент або None, якщо за timeout нічого не з'явилось"""
     try:
-        li_items = driver.find_elements(By.CSS_SELECTOR, "#all_sellers-block li")
-        if li_items:
-            logging.info(f"✓ Найдены li елементы ({len(li_items)}), продовжаєм")
+        if timeout <= 0:
+            return _find_first(driver, selectors) or None
+        return WebDriverWait(driver, timeout, poll_frequency=0.1).until(lambda d: _find_first(d, selectors))
+    except TimeoutException:
+        return None
+
+def scroll_until_present(driver, selector, timer, step_wait=SELENIUM_SCROLL_STEP_WAIT):
+    """Прокручує сторінку по екрану, поки не з'явиться лениво завантажуваний блок.
+
+    Блок вважається відсутнім, якщо досягнуто кінця сторінки, а він так і не з'явився.
+    """
+    while timer.remaining() > 0:
+        element = wait_for_any(driver, [selector], timer.remaining(step_wait))
+        if element:
+            return element
+        at_bottom = driver.execute_script(
+            "window.scrollBy(0, window.innerHeight);"
+            "return window.scrollY + window.innerHeight >= document.documentElement.scrollHeight - 2;"
+        )
+        if at_bottom:
+            return wait_for_any(driver, [selector], timer.remaining(SELENIUM_ABSENT_GRACE))
+    return None
+
+def wait_for_content_load(driver, timeout=30):
+    logging.info("⏳ [Selenium] Очікування загрузки контенту...")
+
+    def offers_ready(d):
+        if d.find_elements(By.CSS_SELECTOR, "#all_sellers-block li"):
             return True
-    except:
-        pass
-    
+        return not d.find_elements(By.CSS_SELECTOR, "rz-slider-placeholder")
+
     try:
-        offers = driver.find_element(By.CSS_SELECTOR, "rz-product-offers")
-        if offers:
-            logging.info("✓ Блок rz-product-offers найден, продовжаєм")
-            return True
-    except:
+        WebDriverWait(driver, timeout, poll_frequency=0.1).until(offers_ready)
+        logging.info("✓ Контент продавців завантажено")
+        return True
+    except TimeoutException:
         pass
-    
+
+    if driver.find_elements(By.CSS_SELECTOR, "rz-product-offers"):
+        logging.info("✓ Блок rz-product-offers найден, продовжаєм")
+        return True
+
     logging.warning("⚠️ Контент не загрузився")
     return False
 
-async def fetch_page(session, url, delay=0.2):
+async def fetch_page(session, url):
     try:
         logging.info(f"Отримання сторінки: {url}")
-        response = session.get(url, timeout=15)
+        response = await session.get(url, timeout=15)
         response.raise_for_status()
-        await asyncio.sleep(random.uniform(delay, delay + 0.3))
         return response.json().get('data', {})
     except Exception as e:
         logging.error(f"Помилка: {e}")
@@ -241,9 +944,8 @@ async def fetch_page(session, url, delay=0.2):
 async def fetch_wishlist_count(session, product_id):
     try:
         url = f"https://uss.rozetka.com.ua/session/wishlist/count-goods?country=UA&lang=ua&goods_ids={product_id}"
-        response = session.get(url, timeout=10)
+        response = await session.get(url, timeout=10)
         response.raise_for_status()
-        await asyncio.sleep(random.uniform(0.1, 0.2))
         json_data = response.json()
         data_array = json_data.get('data', [])
         return data_array[0].get('count', 0) if data_array else 0
@@ -251,144 +953,153 @@ async def fetch_wishlist_count(session, product_id):
         logging.error(f"Помилка wishlist: {e}")
         return 0
 
-async def fetch_product_reviews(session, product_id):
-    try:
-        url = f"https://rozetka.com.ua/ua/{product_id}/p{product_id}/comments/"
-        logging.info(f"Парсинг відгуків товару: {url}")
-        
-        response = session.get(url, timeout=15)
-        response.raise_for_status()
-        await asyncio.sleep(random.uniform(0.2, 0.4))
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        ratings = []
-        rating_divs = soup.find_all('div', class_='stars__rating')
-        
-        for div in rating_divs[:3]:
-            style = div.get('style', '')
-            match = re.search(r'width:\s*calc\((\d+)%', style)
-            if match:
-                percent = int(match.group(1))
-                stars = percent / 20
-                ratings.append(stars)
-        
-        if len(ratings) >= 3:
-            avg = sum(ratings) / len(ratings)
-            logging.info(f"✓ Знайдено {len(ratings)} оцінок товару, середня: {avg:.2f}")
-            return round(avg, 2)
-        elif len(ratings) > 0:
-            logging.warning(f"Недостатньо відгуків (знайдено {len(ratings)}, потрібно 3)")
-            return None
-        else:
-            logging.warning(f"Відгуки не знайдено")
-            return None
-            
-    except Exception as e:
-        logging.error(f"Помилка парсингу відгуків товару: {e}")
+async def fetch_wishlist_counts(session, product_ids):
+    """Кількість у списках бажань для набору товарів одним запитом на кожні WISHLIST_BATCH_SIZE id"""
+    counts = {}
+    for i in range(0, len(product_ids), WISHLIST_BATCH_SIZE):
+        chunk = product_ids[i:i + WISHLIST_BATCH_SIZE]
+        try:
+            ids_str = ','.join(map(str, chunk))
+            url = f"https://uss.rozetka.com.ua/session/wishlist/count-goods?country=UA&lang=ua&goods_ids={ids_str}"
+            response = await session.get(url, timeout=10)
+            response.raise_for_status()
+            data_array = response.json().get('data', [])
+            for idx, item in enumerate(data_array):
+                goods_id = item.get('goods_id', item.get('id'))
+                if goods_id is None and len(data_array) == len(chunk):
+                    goods_id = chunk[idx]
+                if goods_id is not None:
+                    counts[int(goods_id)] = item.get('count', 0)
+        except Exception as e:
+            logging.error(f"Помилка wishlist (пакет з {len(chunk)} товарів): {e}")
+    return counts
+
+def parse_review_ratings(html):
+    """Оцінки (у зірках) перших трьох відгуків зі сторінки відгуків"""
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    ratings = []
+    rating_divs = soup.find_all('div', class_='stars__rating')
+    
+    for div in rating_divs[:3]:
+        style = div.get('style', '')
+        match = re.search(r'width:\s*calc\((\d+)%', style)
+        if match:
+            percent = int(match.group(1))
+            stars = percent / 20
+            ratings.append(stars)
+    return ratings
+
+async def fetch_product_reviews(session, product_id, offload=False):
+    """Середня оцінка перших трьох відгуків; None, якщо відгуків менше трьох.
+    Помилки запиту не перехоплюються — їх обробляє with_timeout і не зберігає як результат"""
+    url = f"https://rozetka.com.ua/ua/{product_id}/p{product_id}/comments/"
+    logging.info(f"Парсинг відгуків товару: {url}")
+    
+    response = await session.get(url, timeout=15)
+    response.raise_for_status()
+    
+    ratings = await run_parse(parse_review_ratings, offload, response.text)
+    
+    if len(ratings) >= 3:
+        avg = sum(ratings) / len(ratings)
+        logging.info(f"✓ Знайдено {len(ratings)} оцінок товару, середня: {avg:.2f}")
+        return round(avg, 2)
+    elif len(ratings) > 0:
+        logging.warning(f"Недостатньо відгуків (знайдено {len(ratings)}, потрібно 3)")
+        return None
+    else:
+        logging.warning(f"Відгуки не знайдено")
         return None
 
+def empty_offers_data():
+    return {
+        'has_grouping': 'Ні',
+        'grouping_count': 0,
+        'min_price': '',
+        'sellers': [],
+        'videos_count': 0,
+        'credits_count': 0
+    }
+
 async def fetch_selenium_data(product_id, executor):
-    try:
-        url = f"https://rozetka.com.ua/ua/{product_id}/p{product_id}/"
-        logging.info(f"🔍 [Selenium] Початок парсингу даних: {url}")
-        
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(executor, _selenium_fetch_data, url, product_id)
-        
-        return result
-        
-    except Exception as e:
-        logging.error(f"❌ Помилка парсингу даних: {e}")
-        import traceback
-        logging.error(traceback.format_exc())
-        return {
-            'has_grouping': 'Ні',
-            'grouping_count': 0,
-            'min_price': '',
-            'sellers': [],
-            'videos_count': 0,
-            'credits_count': 0
-        }
+    url = f"https://rozetka.com.ua/ua/{product_id}/p{product_id}/"
+    logging.info(f"🔍 [Selenium] Початок парсингу даних: {url}")
+    
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, _selenium_fetch_data, url, product_id)
 
 def _selenium_fetch_data(url, product_id):
     driver = None
+    broken = False
+    timer = PhaseTimer(product_id)
     try:
-        driver = create_selenium_driver()
+        driver = selenium_pool.acquire()
+        timer.mark('драйвер')
+        timer.restart_budget()
         logging.info(f"🔄 [Selenium] Загрузка страницы...")
         driver.get(url)
-        
-        time.sleep(3)
+        timer.mark('завантаження')
         logging.info(f"✓ [Selenium] Страница загружена")
-        
+
+        credits_count = 0
+        container = wait_for_any(driver, [".product-pictogram__list"], timer.remaining(SELENIUM_ABSENT_GRACE))
+        if container:
+            logging.info("✓ [Selenium] Блок .product-pictogram__list найден")
+            items = driver.find_elements(By.CSS_SELECTOR, "div.product-pictogram__item")
+            credits_count = len(items)
+            logging.info(f"✓ [Selenium] Найдено {credits_count} элементов кредитов")
+        else:
+            logging.info("[Selenium] Блок кредитів відсутній")
+        timer.mark('кредити')
 
         logging.info("📜 [Selenium] Скроллинг к блоку продавцов...")
-        try:
-            all_sellers_block = driver.find_element(By.CSS_SELECTOR, "#all_sellers-block")
-            driver.execute_script("arguments[0].scrollIntoView({behavior: 'smooth', block: 'center'});", all_sellers_block)
-            time.sleep(2)
+        all_sellers_block = scroll_until_present(driver, "#all_sellers-block", timer)
+        li_items = []
+        if all_sellers_block:
+            driver.execute_script("arguments[0].scrollIntoView({behavior: 'instant', block: 'center'});", all_sellers_block)
             logging.info("✓ [Selenium] Скроллинг выполнен")
-        except:
-            logging.warning("⚠️ Блок #all_sellers-block не найден для скроллинга")
-        
-        logging.info("🔘 [Selenium] Поиск кнопки группировки...")
-        button_clicked = False
-        button_selectors = [
-            "rz-toggle-button button",
-            "rz-product-offers rz-toggle-button button",
-            "#all_sellers-block rz-toggle-button button",
-            "button[class*='toggle']"
-        ]
-        
-        for selector in button_selectors:
+
+            logging.info("🔘 [Selenium] Поиск кнопки группировки...")
+            button_selectors = [
+                "rz-toggle-button button",
+                "rz-product-offers rz-toggle-button button",
+                "#all_sellers-block rz-toggle-button button",
+                "button[class*='toggle']"
+            ]
+            button = wait_for_any(driver, button_selectors, timer.remaining(SELENIUM_ABSENT_GRACE))
+            button_clicked = False
             try:
-                button = driver.find_element(By.CSS_SELECTOR, selector)
-                if button.is_displayed():
-                    driver.execute_script("arguments[0].scrollIntoView({behavior: 'smooth', block: 'center'});", button)
-                    time.sleep(1)
-                    
+                if button is not None and button.is_displayed():
+                    driver.execute_script("arguments[0].scrollIntoView({behavior: 'instant', block: 'center'});", button)
                     driver.execute_script("arguments[0].click();", button)
-                    logging.info(f"✓ [Selenium] Кнопка нажата (селектор: {selector})")
                     button_clicked = True
-                    
-                    time.sleep(3)
-                    break
-            except NoSuchElementException:
-                continue
             except Exception as e:
-                logging.warning(f"⚠️ Ошибка при нажатии кнопки ({selector}): {e}")
-                continue
-        
-        if button_clicked:
-            logging.info("✓ [Selenium] Кнопка группировки успешно нажата")
-        else:
-            logging.warning("⚠️ [Selenium] Кнопка группировки не найдена или уже активна")
-        
-        if not wait_for_content_load(driver, timeout=30):
-            logging.warning("⚠️ Контент не загрузился полностью")
-        
-        time.sleep(2)
-        
-        selectors = [
-            "#all_sellers-block > rz-product-offers > div > ul > li",
-            "#all_sellers-block rz-product-offers li",
-            "#all_sellers-block li.other-sellers-offers__item",
-            "#all_sellers-block li",
-        ]
-        
-        li_items = []
-        used_selector = None
-        
-        for selector in selectors:
-            logging.info(f"🔍 [Selenium] Пробуєм селектор: {selector}")
-            li_items = driver.find_elements(By.CSS_SELECTOR, selector)
-            if li_items:
-                used_selector = selector
-                logging.info(f"✓ [Selenium] Найдено {len(li_items)} елементів з селектором: {selector}")
-                break
+                logging.warning(f"⚠️ Ошибка при нажатии кнопки: {e}")
+
+            if button_clicked:
+                logging.info("✓ [Selenium] Кнопка группировки успешно нажата")
             else:
-                logging.info(f"  ❌ Селектор не дав результатів")
-        
+                logging.warning("⚠️ [Selenium] Кнопка группировки не найдена или уже активна")
+
+            if not wait_for_content_load(driver, timeout=timer.remaining()):
+                logging.warning("⚠️ Контент не загрузился полностью")
+
+            selectors = [
+                "#all_sellers-block > rz-product-offers > div > ul > li",
+                "#all_sellers-block rz-product-offers li",
+                "#all_sellers-block li.other-sellers-offers__item",
+                "#all_sellers-block li",
+            ]
+
+            for selector in selectors:
+                li_items = driver.find_elements(By.CSS_SELECTOR, selector)
+                if li_items:
+                    logging.info(f"✓ [Selenium] Найдено {len(li_items)} елементів з селектором: {selector}")
+                    break
+        else:
+            logging.info("[Selenium] Блок #all_sellers-block відсутній")
+
         prices = []
         sellers = []
         has_grouping = 'Ні'
@@ -425,16 +1136,13 @@ def _selenium_fetch_data(url, product_id):
                         "[class*='price']",
                     ]
                     
-                    price_found = False
                     for sel in price_selectors:
                         try:
                             price_elem = li.find_element(By.CSS_SELECTOR, sel)
                             price_text = price_elem.text.strip()
                             price_clean = re.sub(r'[^\d]', '', price_text)
                             if price_clean:
-                                price_value = float(price_clean)
-                                prices.append(price_value)
-                                price_found = True
+                                prices.append(float(price_clean))
                                 break
                         except NoSuchElementException:
                             continue
@@ -443,38 +1151,17 @@ def _selenium_fetch_data(url, product_id):
                     logging.error(f"     ❌ Ошибка обработки карточки #{idx}: {e}")
             
             min_price = min(prices) if prices else ''
-        
-
-        logging.info("📜 [Selenium] Скроллинг до конца страницы для видео...")
-        for _ in range(22):
-            driver.execute_script("window.scrollBy(0, 500);")
-            time.sleep(0.2)
-        
+        timer.mark('продавці')
 
+        logging.info("📜 [Selenium] Скроллинг к блоку видео...")
         videos_count = 0
-        video_base_selector = "#videos-block > section > div > rz-product-video-slider > rz-scroller > div > div > div:nth-child({})"
-        while True:
-            try:
-                driver.find_element(By.CSS_SELECTOR, video_base_selector.format(videos_count + 1))
-                videos_count += 1
-            except NoSuchElementException:
-                break
-        
-
-
-
-
-
-        credits_count = 0
-        try:
-            wait = WebDriverWait(driver, 10)
-            container = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ".product-pictogram__list")))
-            logging.info("✓ [Selenium] Блок .product-pictogram__list найден")
-            items = driver.find_elements(By.CSS_SELECTOR, "div.product-pictogram__item")
-            credits_count = len(items)
-            logging.info(f"✓ [Selenium] Найдено {credits_count} элементов кредитов")
-        except Exception as e:
-            logging.error(f"❌ [Selenium] Ошибка парсинга кредитов: {e}")
+        video_item_selector = "#videos-block > section > div > rz-product-video-slider > rz-scroller > div > div > div"
+        if scroll_until_present(driver, "#videos-block", timer):
+            if wait_for_any(driver, [video_item_selector], timer.remaining(SELENIUM_ABSENT_GRACE)):
+                videos_count = len(driver.find_elements(By.CSS_SELECTOR, video_item_selector))
+        else:
+            logging.info("[Selenium] Блок #videos-block відсутній")
+        timer.mark('відео')
         
         logging.info(f"✅ [Selenium] Парсинг завершен:")
         logging.info(f"   - Группировка: {has_grouping}")
@@ -494,81 +1181,327 @@ def _selenium_fetch_data(url, product_id):
         }
         
     except Exception as e:
+        broken = isinstance(e, WebDriverException)
         logging.error(f"❌ [Selenium] Критическая ошибка: {e}")
         import traceback
         logging.error(traceback.format_exc())
-        return {
-            'has_grouping': 'Ні',
-            'grouping_count': 0,
-            'min_price': '',
-            'sellers': [],
-            'videos_count': 0,
-            'credits_count': 0
-        }
+        raise
     finally:
+        timer.log()
         if driver:
-            driver.quit()
+            selenium_pool.release(driver, broken=broken)
 
-async def fetch_product_page(session, url, executor):
+async def fetch_product_page(session, url, headers=None):
+    """Відповідь сторінки товару (200 або 304 на умовний запит) чи None при помилці"""
     try:
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(executor, lambda: session.get(url, timeout=15))
+        response = await session.get(url, headers=headers, timeout=15)
         response.raise_for_status()
-        await asyncio.sleep(random.uniform(0.2, 0.5))
-        return response.text
+        return response
     except Exception as e:
         logging.error(f"Помилка: {e}")
         return None
 
-def parse_characteristics(html: str):
+def conditional_headers(entry):
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers or None
+
+def parse_product_page(html, product_id, offers=True, characteristics=True):
+    """Сторінка товару → компактний dict; стан сторінки декодується один раз. Виконується в пулі парсингу"""
+    state = extract_page_state(html)
+    return {
+        'offers': parse_http_product_data(html, product_id, state) if offers else None,
+        'characteristics': parse_characteristics(html, product_id, state) if characteristics else None,
+    }
+
+async def resolve_characteristics(product_id, cached, fresh, page_task):
+    """(characteristics, warranty) з кешу, після 304 Not Modified або з нового парсингу сторінки"""
+    if fresh:
+        return cached['characteristics'], cached['warranty']
+    response, parsed = await asyncio.shield(page_task)
+    if response is not None and response.status_code == 304 and cached:
+        await asyncio.to_thread(characteristics_cache.refresh, product_id)
+        return cached['characteristics'], cached['warranty']
+    if parsed is None:
+        return (cached['characteristics'], cached['warranty']) if cached else ({}, '')
+    characteristics, warranty = parsed['characteristics']
+    if not characteristics:
+        # Порожній результат дають і помилка парсингу, і сторінка-заглушка Cloudflare з кодом 200 —
+        # у кеш він не йде, щоб не ховати характеристики товару на весь CHARS_CACHE_TTL
+        if cached:
+            return cached['characteristics'], cached['warranty']
+        return characteristics, warranty
+    await asyncio.to_thread(characteristics_cache.set_many, {product_id: {
+        'characteristics': characteristics,
+        'warranty': warranty,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }})
+    return characteristics, warranty
+
+def parse_characteristics(html: str, product_id=None, state=None, parser: str = None):
+    """Характеристики й гарантія: зі стану сторінки, якщо відомий product_id, інакше з DOM"""
     if not html:
         return {}, ''
     try:
-        soup = BeautifulSoup(html, 'html.parser')
-        characteristics = {}
-        char_lists = soup.find_all('dl', class_='list')
-        for char_list in char_lists:
-            items = char_list.find_all('div', class_='item')
-            for item in items:
-                label_elem = item.find('dt', class_='label')
-                value_elem = item.find('dd', class_='value')
-                if label_elem and value_elem:
-                    label = label_elem.get_text(strip=True)
-                    values = []
-                    sub_list = value_elem.find('ul', class_='sub-list')
-                    if sub_list:
-                        for li in sub_list.find_all('li'):
-                            link = li.find('a')
-                            text = link.get_text(strip=True) if link else li.get_text(strip=True)
-                            if text:
-                                values.append(text)
-                    if values:
-                        characteristics[label] = ', '.join(values)
-        warranty_div = soup.find('div', {'rzhasoverflow': True, 'class': lambda x: x and 'flex-1' in x})
-        warranty = warranty_div.get_text(strip=True).replace('\xa0', ' ') if warranty_div else ''
-        return characteristics, warranty
+        if product_id is not None:
+            result = parse_state_characteristics(state if state is not None else extract_page_state(html), product_id)
+            if result is not None:
+                return result
+        return CHARS_PARSERS[parser or CHARS_PARSER](html)
     except Exception as e:
         logging.error(f"Помилка парсингу: {e}")
         return {}, ''
 
-async def fetch_delivery_info(session, product_id, price):
+CLIENT_STATE_RE = re.compile(r'<script[^>]*id="rz-client-state"[^>]*>(.*?)</script>', re.S)
+TRANSFER_STATE_ESCAPES = {'&q;': '"', '&a;': '&', '&s;': "'", '&l;': '<', '&g;': '>'}
+
+def extract_page_state(html: str):
+    """Декодує серверний стан сторінки (Angular TransferState з <script id="rz-client-state">)"""
+    if not html:
+        return None
+    match = CLIENT_STATE_RE.search(html)
+    if not match:
+        return None
+    raw = match.group(1).strip()
     try:
-        url = f"https://product-api.rozetka.com.ua/v4/deliveries/get-deliveries?country=UA&lang=ua&city_id=b205dde2-2e2e-4eb9-aef2-a67c82bbdf27&cost={price}&product_id={product_id}"
-        response = session.get(url, timeout=15)
-        response.raise_for_status()
-        await asyncio.sleep(random.uniform(0.1, 0.3))
-        data = response.json().get('data', {})
-        deliveries = []
-        for d in data.get('deliveries', []):
-            cost = d.get('cost', {})
-            cost_value = cost.get('new') if cost.get('new') is not None else cost.get('text', 'Н/Д')
-            deliveries.append({'title': d.get('title', ''), 'cost': cost_value})
-        return {'deliveries': deliveries, 'payments': data.get('payments', '')}
+        return json.loads(raw)
+    except ValueError:
+        pass
+    for escaped, char in TRANSFER_STATE_ESCAPES.items():
+        raw = raw.replace(escaped, char)
+    try:
+        return json.loads(raw)
+    except ValueError as e:
+        logging.warning(f"Не вдалося декодувати стан сторінки: {e}")
+        return None
+
+def _state_product_nodes(state, product_id):
+    """Вузли стану, що описують саме цей товар: id/goods_id/goodsId збігається з product_id"""
+    nodes, stack = [], [state]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            if _state_node_id(current) == str(product_id):
+                nodes.append(current)
+            stack.extend(v for v in current.values() if isinstance(v, (dict, list)))
+        elif isinstance(current, list):
+            stack.extend(v for v in current if isinstance(v, (dict, list)))
+    return nodes
+
+def _state_node_id(node):
+    for key in ('id', 'goods_id', 'goodsId'):
+        if key in node:
+            return str(node[key])
+    return None
+
+def _product_state_values(nodes, key_names):
+    """Значення ключів key_names у вузлах товару, не заходячи у вкладені вузли з іншим id
+    (пов'язані й рекомендовані товари, продавці, пропозиції)"""
+    for node in nodes:
+        product_id = _state_node_id(node)
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if isinstance(current, dict):
+                if current is not node and _state_node_id(current) not in (None, product_id):
+                    continue
+                for key, value in current.items():
+                    if key in key_names:
+                        yield value
+                    if isinstance(value, (dict, list)):
+                        stack.append(value)
+            elif isinstance(current, list):
+                stack.extend(v for v in current if isinstance(v, (dict, list)))
+
+def _product_state_list(nodes, key_names):
+    """Перший список під одним з key_names у вузлах товару; None, якщо жодного такого ключа немає"""
+    for value in _product_state_values(nodes, key_names):
+        if isinstance(value, list):
+            return value
+    return None
+
+def _offer_price(offer):
+    price = offer.get('price')
+    if isinstance(price, dict):
+        price = price.get('value') or price.get('current')
+    try:
+        return float(price)
+    except (TypeError, ValueError):
+        return None
+
+def _offer_seller(offer):
+    seller = offer.get('seller')
+    if isinstance(seller, dict):
+        return seller.get('title') or seller.get('name') or ''
+    return offer.get('seller_title') or ''
+
+def _offers_result(sellers, prices, videos_count, credits_count, grouping_count):
+    return {
+        'has_grouping': 'Так' if grouping_count else 'Ні',
+        'grouping_count': grouping_count,
+        'min_price': min(prices) if prices else '',
+        'sellers': sellers,
+        'videos_count': videos_count,
+        'credits_count': credits_count
+    }
+
+def parse_state_product_data(state, product_id):
+    """Продавці, відео та кредити з вузла цього товару в стані сторінки; None, якщо вузла
+    або пропозицій продавців у ньому немає — тоді працює DOM/Selenium fallback"""
+    nodes = _state_product_nodes(state, product_id) if state else []
+    if not nodes:
+        return None
+    offers = _product_state_list(nodes, ('offers', 'other_sellers', 'sellers_offers'))
+    videos = _product_state_list(nodes, ('videos', 'video'))
+    pictograms = _product_state_list(nodes, ('pictograms', 'credit_pictograms'))
+    if offers is None:
+        return None
+    offers = [o for o in offers if isinstance(o, dict)]
+    sellers = [s for s in (_offer_seller(o) for o in offers) if s]
+    prices = [p for p in (_offer_price(o) for o in offers) if p is not None]
+    return _offers_result(sellers, prices, len(videos or []), len(pictograms or []), len(offers))
+
+def _state_text(value):
+    if isinstance(value, dict):
+        value = value.get('title') or value.get('text') or value.get('value') or value.get('name')
+    if value is None or isinstance(value, (dict, list)):
+        return ''
+    return str(value).replace('\xa0', ' ').strip()
+
+def _state_option_values(option):
+    values = option.get('values')
+    if values is None:
+        values = option.get('value')
+    if not isinstance(values, list):
+        values = [values]
+    return [text for text in (_state_text(v) for v in values) if text]
+
+def _state_warranty(value):
+    """Текст гарантії; прапорці та числа (warranty: true) текстом гарантії не є"""
+    if isinstance(value, dict):
+        value = value.get('title') or value.get('text') or value.get('value') or value.get('name')
+    return value.replace('\xa0', ' ').strip() if isinstance(value, str) else ''
+
+def parse_state_characteristics(state, product_id):
+    """Характеристики й гарантія зі стану сторінки; None, якщо стан не цього товару або характеристик у ньому немає"""
+    nodes = _state_product_nodes(state, product_id) if state else []
+    if not nodes:
+        return None
+    characteristics = {}
+    for group in _product_state_list(nodes, ('characteristics', 'groups_characteristics', 'characteristics_groups')) or []:
+        if not isinstance(group, dict):
+            continue
+        options = group.get('options') if isinstance(group.get('options'), list) else [group]
+        for option in options:
+            if not isinstance(option, dict):
+                continue
+            label = _state_text(option.get('title') or option.get('name'))
+            values = _state_option_values(option)
+            if label and values:
+                characteristics[label] = ', '.join(values)
+    if not characteristics:
+        return None
+    warranty = next((text for text in (_state_warranty(v) for v in _product_state_values(nodes, ('warranty', 'warranty_text')))
+                     if text), '')
+    return characteristics, warranty
+
+def parse_dom_product_data(html):
+    """Ті самі поля з серверно відрендереного DOM; None, якщо в HTML немає блоку продавців
+    (зазвичай він рендериться на клієнті — тоді дані бере Selenium)"""
+    soup = BeautifulSoup(html, 'html.parser')
+    if soup.select_one("#all_sellers-block") is None:
+        return None
+    li_items = soup.select("#all_sellers-block li")
+    video_items = soup.select("#videos-block > section > div > rz-product-video-slider > rz-scroller > div > div > div")
+
+    sellers, prices = [], []
+    for li in li_items:
+        seller_elem = li.select_one("a.other-sellers-offers__seller-link, a[href*='/seller/'], .seller-name, a[class*='seller']")
+        if seller_elem and seller_elem.get_text(strip=True):
+            sellers.append(seller_elem.get_text(strip=True))
+        price_elem = li.select_one("p.other-sellers-offers__product-price-main--red, p.other-sellers-offers__product-price-main, [class*='price']")
+        price_clean = re.sub(r'[^\d]', '', price_elem.get_text()) if price_elem else ''
+        if price_clean:
+            prices.append(float(price_clean))
+    credits_count = len(soup.select("div.product-pictogram__item"))
+    return _offers_result(sellers, prices, len(video_items), credits_count, len(li_items))
+
+def parse_http_product_data(html, product_id, state=None):
+    """Продавці в групуванні, відео та кредити без браузера: спершу зі стану сторінки, потім з DOM"""
+    if not html:
+        return None
+    try:
+        data = parse_state_product_data(state if state is not None else extract_page_state(html), product_id)
+        if data is None:
+            data = parse_dom_product_data(html)
+        return data
     except Exception as e:
-        logging.error(f"Помилка доставки: {e}")
-        return {'deliveries': [], 'payments': ''}
+        logging.error(f"Помилка HTTP-парсингу товару {product_id}: {e}")
+        return None
+
+def delivery_cache_key(product_id, city_id, price):
+    """Ключ кешу доставки: товар, місто і цінова смуга шириною DELIVERY_PRICE_BAND грн"""
+    return f"{product_id}:{city_id}:{int(float(price) // DELIVERY_PRICE_BAND)}"
+
+async def fetch_delivery_info(session, product_id, price, city_id=DELIVERY_CITY_ID):
+    """Способи доставки в місто; помилки запиту обробляє with_timeout, вони не кешуються"""
+    key = delivery_cache_key(product_id, city_id, price)
+    cached = (await asyncio.to_thread(delivery_cache.get_many, [key])).get(key)
+    if cached is not None:
+        return cached
+    url = f"https://product-api.rozetka.com.ua/v4/deliveries/get-deliveries?country=UA&lang=ua&city_id={urllib.parse.quote(str(city_id), safe='')}&cost={price}&product_id={product_id}"
+    response = await session.get(url, timeout=15)
+    response.raise_for_status()
+    data = response.json().get('data', {})
+    deliveries = []
+    for d in data.get('deliveries', []):
+        cost = d.get('cost', {})
+        cost_value = cost.get('new') if cost.get('new') is not None else cost.get('text', 'Н/Д')
+        deliveries.append({'title': d.get('title', ''), 'cost': cost_value})
+    delivery_info = {'deliveries': deliveries, 'payments': data.get('payments', '')}
+    await asyncio.to_thread(delivery_cache.set_many, {key: delivery_info})
+    return delivery_info
+
+async def with_timeout(coro, timeout, default, label, product_id):
+    """Виконує крок збагачення з таймаутом; при помилці чи таймауті повертає значення за замовчуванням"""
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"⏱ {label} для {product_id}: перевищено {timeout:g}с, використовуємо значення за замовчуванням")
+    except Exception as e:
+        logging.error(f"Помилка {label} для {product_id}: {e}")
+    return default
+
+def enrichment_inputs(product, delivery_city_id):
+    """Поля getDetails, від яких залежить результат кожного дорогого кроку збагачення"""
+    seller = product.get('seller') or {}
+    return {
+        'offers': {'price': product.get('price'), 'old_price': product.get('old_price'), 'seller': seller.get('id') or seller.get('title')},
+        'reviews': {'comments_amount': product.get('comments_amount')},
+        'delivery': {'price': product.get('price'), 'city_id': delivery_city_id},
+    }
+
+STEP_FAILED = object()
+
+def reusable_steps(snapshot, inputs):
+    """Кроки, чиї входи не змінились з минулого збагачення: {крок: збережене значення}.
 
-async def process_product(session, product, executor, include_chars=True, mode="search"):
+    Перевикористовуються всі успішні значення, зокрема порожні (немає групування, менше трьох
+    відгуків); кроки, що завершились помилкою чи таймаутом (failed), виконуються знову.
+    """
+    reused = {}
+    for step, step_inputs in inputs.items():
+        saved = (snapshot or {}).get(step)
+        if saved and saved['inputs'] == step_inputs and saved.get('failed') is False:
+            reused[step] = saved['value']
+    return reused
+
+async def process_product(session, product, executor, include_chars=True, mode="search", extraction_engine=EXTRACTION_ENGINE, wishlist_count=None,
+                          delivery_city_id=DELIVERY_CITY_ID, offload_parsing=False, progress=None):
     href = product.get('href', '')
     product_id = product.get('id')
     price = product.get('price', 0)
@@ -576,33 +1509,106 @@ async def process_product(session, product, executor, include_chars=True, mode="
     if not href or not product_id:
         return product
     
-    wishlist_count = await fetch_wishlist_count(session, product_id)
-    characteristics, warranty = {}, ''
-    product_avg_rating = None
-    selenium_data = await fetch_selenium_data(product_id, executor)
-    
+    seller_extras = mode == "seller" and not include_chars
+    cached_chars, chars_fresh = None, False
     if include_chars:
-        html = await fetch_product_page(session, href, executor)
-        characteristics, warranty = parse_characteristics(html)
+        cached_chars, chars_fresh = await asyncio.to_thread(characteristics_cache.lookup, product_id)
+    
+    snapshot, snapshot_fresh = await asyncio.to_thread(snapshot_cache.lookup, product_id)
+    inputs = enrichment_inputs(product, delivery_city_id)
+    reused = reusable_steps(snapshot if snapshot_fresh else None, inputs)
+    steps = {'offers'} | ({'reviews'} if seller_extras else set()) | ({'delivery'} if price else set())
+    
+    html_task = None
+    if extraction_engine == "http" and 'offers' not in reused:
+        html_task = asyncio.ensure_future(fetch_product_page(session, href))
+    elif include_chars and not chars_fresh:
+        page_headers = conditional_headers(cached_chars) if cached_chars else None
+        html_task = asyncio.ensure_future(fetch_product_page(session, href, page_headers))
+    
+    async def parse_page():
+        response = await html_task
+        if response is None or response.status_code == 304:
+            return response, None
+        parsed = await run_parse(parse_product_page, offload_parsing, response.text, product_id,
+                                 extraction_engine == "http" and 'offers' not in reused, include_chars and not chars_fresh)
+        return response, parsed
     
-    if mode == "seller" and not include_chars:
-        product_avg_rating = await fetch_product_reviews(session, product_id)
+    page_task = asyncio.ensure_future(parse_page()) if html_task is not None else None
     
-    delivery_info = await fetch_delivery_info(session, product_id, price) if product_id and price else None
+    async def get_wishlist_count():
+        if wishlist_count is not None:
+            return wishlist_count
+        return await fetch_wishlist_count(session, product_id)
     
-    logging.info(f"Оброблено: {product.get('title', '')[:50]}")
+    async def get_offers_data():
+        data = None
+        if extraction_engine == "http":
+            response, parsed = await asyncio.shield(page_task)
+            if parsed is not None:
+                data = parsed['offers']
+            if data is None:
+                logging.info(f"HTTP-режим не дав даних для {product_id}, fallback на Selenium")
+        if data is None:
+            data = await fetch_selenium_data(product_id, executor)
+        return data
+    
+    async def get_characteristics():
+        return await resolve_characteristics(product_id, cached_chars, chars_fresh, page_task)
+    
+    async def ready(value):
+        return value
+    
+    failed = set()
+    
+    async def snapshot_step(step, coro, timeout, default, label):
+        value = await with_timeout(coro, timeout, STEP_FAILED, label, product_id)
+        if value is STEP_FAILED:
+            failed.add(step)
+            return default
+        return value
+    
+    try:
+        wishlist, selenium_data, (characteristics, warranty), product_avg_rating, delivery_info = await asyncio.gather(
+            with_timeout(get_wishlist_count(), ENRICH_CALL_TIMEOUT, 0, "wishlist", product_id),
+            ready(reused['offers']) if 'offers' in reused else
+            snapshot_step('offers', get_offers_data(), SELENIUM_CALL_TIMEOUT, empty_offers_data(), "продавці/відео/кредити"),
+            with_timeout(get_characteristics(), ENRICH_CALL_TIMEOUT, ({}, ''), "характеристики", product_id)
+            if include_chars else ready(({}, '')),
+            ready(None) if not seller_extras else ready(reused['reviews']) if 'reviews' in reused else
+            snapshot_step('reviews', fetch_product_reviews(session, product_id, offload_parsing), ENRICH_CALL_TIMEOUT, None, "відгуки"),
+            ready(None) if not price else ready(reused['delivery']) if 'delivery' in reused else
+            snapshot_step('delivery', fetch_delivery_info(session, product_id, price, delivery_city_id), ENRICH_CALL_TIMEOUT,
+                          {'deliveries': [], 'payments': ''}, "доставка"),
+        )
+    finally:
+        if page_task is not None:
+            page_task.cancel()
+            html_task.cancel()
+    
+    values = {'offers': selenium_data, 'reviews': product_avg_rating, 'delivery': delivery_info}
+    enriched_steps = steps - set(reused)
+    if enriched_steps:
+        await asyncio.to_thread(snapshot_cache.set_many, {product_id: {
+            **(snapshot or {}),
+            **{step: {'inputs': inputs[step], 'value': values[step], 'failed': step in failed} for step in enriched_steps},
+        }})
+    if progress:
+        progress.add_enrichment(reused=not enriched_steps)
+    
+    logging.info(f"Оброблено: {product.get('title', '')[:50]}" + ("" if enriched_steps else " (без змін, дані зі знімка)"))
     
     result = {
         **product, 
         'characteristics': characteristics, 
         'warranty': warranty,
-        'wishlist_count': wishlist_count, 
+        'wishlist_count': wishlist, 
         'delivery': delivery_info,
         'videos_count': selenium_data['videos_count'],
         'credits_count': selenium_data['credits_count']
     }
     
-    if mode == "seller" and not include_chars:
+    if seller_extras:
         result['product_avg_rating'] = product_avg_rating
         result['has_grouping'] = selenium_data['has_grouping']
         result['grouping_count'] = selenium_data['grouping_count']
@@ -611,19 +1617,240 @@ async def process_product(session, product, executor, include_chars=True, mode="
     
     return result
 
+async def iter_id_list(product_ids):
+    yield product_ids
+
+async def run_pipeline(session, id_source, executor, include_chars, mode, extraction_engine=EXTRACTION_ENGINE, progress=None,
+                       delivery_city_id=DELIVERY_CITY_ID, expected_count=None, checkpoint=None):
+    """Потоковий конвеєр: id товарів → getDetails пачками → пул воркерів збагачення.
+
+    id_source — асинхронний ітератор списків id (наприклад, сторінок видачі). Стадії getDetails і
+    збагачення мають власні ліміти паралельності (DETAILS_CONCURRENCY, ENRICH_WORKERS), а обмежені
+    черги між ними зупиняють попередню стадію, поки наступна не розбере чергу.
+    Повертає оброблені товари в порядку надходження id; progress (JobProgress) отримує лічильники.
+    Розбір HTML іде в пул процесів, якщо очікується не менше PARSE_POOL_MIN_PRODUCTS товарів (expected_count).
+    Товари з checkpoint (JobCheckpoint) не збагачуються повторно, нові — зберігаються в нього.
+    """
+    offload_parsing = expected_count is None or expected_count >= PARSE_POOL_MIN_PRODUCTS
+    batch_queue = asyncio.Queue(maxsize=DETAILS_CONCURRENCY)
+    product_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    results = {}
+
+    async def produce_batches():
+        batch, position = [], 0
+        async for product_ids in id_source:
+            if progress:
+                await progress.add_page(len(product_ids))
+            for product_id in product_ids:
+                batch.append(product_id)
+                if len(batch) == DETAILS_BATCH_SIZE:
+                    await batch_queue.put((position, batch))
+                    position += len(batch)
+                    batch = []
+        if batch:
+            await batch_queue.put((position, batch))
+        for _ in range(DETAILS_CONCURRENCY):
+            await batch_queue.put(None)
+
+    async def details_worker():
+        while True:
+            item = await batch_queue.get()
+            if item is None:
+                return
+            position, batch = item
+            done = checkpoint.products if checkpoint else {}
+            if all(str(product_id) in done for product_id in batch):
+                details = [done[str(product_id)] for product_id in batch]
+            else:
+                details = await fetch_details(session, batch)
+            wishlist_counts = await fetch_wishlist_counts(
+                session, [p.get('id') for p in details if p.get('id') and str(p.get('id')) not in done])
+            if progress:
+                progress.add_batch()
+            for offset, product in enumerate(details):
+                if str(product.get('id')) in done:
+                    results[position + offset] = done[str(product.get('id'))]
+                    if progress:
+                        await progress.add_processed()
+                    continue
+                await product_queue.put((position + offset, product, wishlist_counts.get(product.get('id'))))
+
+    async def enrich_worker():
+        while True:
+            item = await product_queue.get()
+            if item is None:
+                return
+            position, product, wishlist_count = item
+            try:
+                results[position] = await process_product(session, product, executor, include_chars, mode,
+                                                           extraction_engine, wishlist_count, delivery_city_id, offload_parsing,
+                                                           progress)
+                if checkpoint:
+                    await checkpoint.add_product(results[position])
+            except Exception as e:
+                logging.error(f"Помилка збагачення товару {product.get('id')}: {e}")
+                results[position] = product
+            if progress:
+                await progress.add_processed()
+
+    producer = asyncio.create_task(produce_batches())
+    details_tasks = [asyncio.create_task(details_worker()) for _ in range(DETAILS_CONCURRENCY)]
+    enrich_tasks = [asyncio.create_task(enrich_worker()) for _ in range(ENRICH_WORKERS)]
+    try:
+        await asyncio.gather(producer, *details_tasks)
+        for _ in enrich_tasks:
+            await product_queue.put(None)
+        await asyncio.gather(*enrich_tasks)
+    finally:
+        for task in [producer, *details_tasks, *enrich_tasks]:
+            task.cancel()
+        if checkpoint:
+            await checkpoint.flush()
+
+    logging.info(f"Всього оброблено товарів: {len(results)}")
+    return [results[position] for position in sorted(results)]
+
 async def fetch_details(session, product_ids):
+    """getDetails з персистентним кешем: з API запитуються лише відсутні або застарілі id"""
+    cached = await asyncio.to_thread(details_cache.get_many, product_ids)
+    missing = [pid for pid in product_ids if str(pid) not in cached]
+    fetched = {}
+    if missing:
+        for product in await fetch_details_remote(session, missing):
+            if product.get('id'):
+                fetched[str(product['id'])] = product
+        if fetched:
+            await asyncio.to_thread(details_cache.set_many, fetched)
+    logging.info(f"getDetails: {len(cached)} з кешу, {len(missing)} запитано з API")
+    return [cached.get(str(pid)) or fetched[str(pid)] for pid in product_ids if str(pid) in cached or str(pid) in fetched]
+
+async def fetch_details_remote(session, product_ids):
     try:
         ids_str = ','.join(map(str, product_ids))
         url = f"https://xl-catalog-api.rozetka.com.ua/v4/goods/getDetails?country=UA&lang=ua&goods_group_href=0&product_ids={ids_str}&with_docket=1&with_extra_info=1&with_groups=1"
         detail_headers = {'X-Requested-With': 'XMLHttpRequest'}
-        response = session.get(url, headers=detail_headers, timeout=15)
+        response = await session.get(url, headers=detail_headers, timeout=15)
         response.raise_for_status()
-        await asyncio.sleep(random.uniform(0.5, 1))
         return response.json().get('data', [])
     except Exception as e:
         logging.error(f"Помилка деталей: {e}")
         return []
 
+cache_registry = {}
+
+class SqliteTTLCache:
+    """Персистентний кеш у SQLite з TTL, LRU-витісненням за max_entries і лічильниками влучань.
+
+    Кожен простір імен — окрема таблиця (key, value JSON, stored_at, accessed_at) у CACHE_DB_PATH.
+    Методи синхронні й потокобезпечні, з event loop їх варто викликати через asyncio.to_thread.
+    """
+
+    def __init__(self, table, ttl, max_entries, path=CACHE_DB_PATH):
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT, stored_at REAL, accessed_at REAL)")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_accessed_at ON {table}(accessed_at)")
+        self._conn.commit()
+        cache_registry[table] = self
+
+    def _select(self, keys):
+        rows = {}
+        for i in range(0, len(keys), CACHE_SQL_CHUNK):
+            chunk = keys[i:i + CACHE_SQL_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            for key, value, stored_at in self._conn.execute(
+                    f"SELECT key, value, stored_at FROM {self.table} WHERE key IN ({placeholders})", chunk):
+                rows[key] = (value, stored_at)
+        return rows
+
+    def _touch(self, keys, now, refresh=False):
+        column = "stored_at=?, accessed_at=?" if refresh else "accessed_at=?"
+        params = (now, now) if refresh else (now,)
+        self._conn.executemany(f"UPDATE {self.table} SET {column} WHERE key=?", [(*params, key) for key in keys])
+
+    def get_many(self, keys):
+        """Свіжі (молодші за ttl) значення для keys; відсутні й застарілі рахуються як промахи"""
+        keys = [str(key) for key in keys]
+        now = time.time()
+        with self._lock:
+            rows = self._select(keys)
+            fresh = {key: json.loads(value) for key, (value, stored_at) in rows.items() if now - stored_at < self.ttl}
+            self._touch(list(fresh), now)
+            self._conn.commit()
+            self.hits += len(fresh)
+            self.misses += len(keys) - len(fresh)
+        return fresh
+
+    def lookup(self, key):
+        """(значення, свіже чи ні) або (None, False); застарілий запис повертається для умовної перевірки"""
+        key = str(key)
+        now = time.time()
+        with self._lock:
+            row = self._select([key]).get(key)
+            if row is None:
+                self.misses += 1
+                return None, False
+            fresh = now - row[1] < self.ttl
+            if fresh:
+                self.hits += 1
+                self._touch([key], now)
+                self._conn.commit()
+            else:
+                self.misses += 1
+        return json.loads(row[0]), fresh
+
+    def set_many(self, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                [(str(key), json.dumps(value, ensure_ascii=False), now, now) for key, value in items.items()])
+            self._evict()
+            self._conn.commit()
+
+    def refresh(self, key):
+        """Продовжує життя запису без зміни значення (наприклад, після 304 Not Modified)"""
+        with self._lock:
+            self.revalidations += 1
+            self._touch([str(key)], time.time(), refresh=True)
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)", (excess,))
+            self.evictions += excess
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+            'revalidations': self.revalidations,
+        }
+
+details_cache = SqliteTTLCache("details_cache", DETAILS_CACHE_TTL, DETAILS_CACHE_MAX_ENTRIES)
+delivery_cache = SqliteTTLCache("delivery_cache", DELIVERY_CACHE_TTL, DELIVERY_CACHE_MAX_ENTRIES)
+characteristics_cache = SqliteTTLCache("characteristics_cache", CHARS_CACHE_TTL, CHARS_CACHE_MAX_ENTRIES)
+snapshot_cache = SqliteTTLCache("product_snapshots", SNAPSHOT_TTL, SNAPSHOT_MAX_ENTRIES)
+
 def get_popular_characteristics(products, threshold=350):
     char_count = {}
     for product in products:
@@ -631,72 +1858,173 @@ def get_popular_characteristics(products, threshold=350):
             char_count[char_name] = char_count.get(char_name, 0) + 1
     return [name for name, count in char_count.items() if count >= threshold]
 
-async def export_to_excel(all_products, search_text, filename, include_chars=True, mode="search"):
-    wb = Workbook()
-    if 'Sheet' in wb.sheetnames:
-        wb.remove(wb['Sheet'])
-    
+HEADER_STYLE_COLORS = {
+    'header_green': "90EE90",
+    'header_dark_green': "006400",
+    'header_orange': "FFA500",
+    'header_gray': "C0C0C0",
+    'header_yellow': "FFFF00",
+}
+SELLER_EXTRA_HEADERS = ['Середня оцінка (перші 3 відгуки)', 'Групування, так/ні', 'Кількість карток у групуванні', 'Мінімальна ціна в групуванні', 'Продавці в групуванні']
+DARK_GREEN_HEADERS = set(SELLER_EXTRA_HEADERS + ['Кількість відео', 'Кількість кредитів'])
+
+def product_category(product):
+    groups = product.get('groups', [])
+    if groups and isinstance(groups, list):
+        group_titles = [g.get('title', '') if hasattr(g, 'get') else str(g) for g in groups]
+        category = ' / '.join([t for t in group_titles if t])
+    else:
+        category = ''
+    if not category:
+        cat = product.get('category', {})
+        if hasattr(cat, 'get'):
+            category = cat.get('title', 'Без категорії')
+        else:
+            category = str(cat) if cat else 'Без категорії'
+    return category
+
+def group_by_category(all_products):
     categories = {}
     for product in all_products:
-        groups = product.get('groups', [])
-        if groups and isinstance(groups, list):
-            group_titles = [g.get('title', '') if hasattr(g, 'get') else str(g) for g in groups]
-            category = ' / '.join([t for t in group_titles if t])
-        else:
-            category = ''
-        if not category:
+        categories.setdefault(product_category(product), []).append(product)
+    return categories
+
+def add_export_styles(wb):
+    """Іменовані стилі експорту: реєструються один раз на книгу і спільні для всіх листів"""
+    center = Alignment(horizontal='center', vertical='center')
+    wb.add_named_style(NamedStyle(name='cell_center', alignment=center))
+    for name, color in HEADER_STYLE_COLORS.items():
+        wb.add_named_style(NamedStyle(name=name, alignment=center,
+                                      fill=PatternFill(start_color=color, end_color=color, fill_type="solid")))
+
+class SheetLayout:
+    """Колонки листа для групи товарів: заголовки, їх стилі та побудова рядків"""
+
+    def __init__(self, products, search_text, include_chars, popular_chars, mode):
+        self.products = products
+        self.search_text = search_text
+        self.include_chars = include_chars
+        self.seller_extras = mode == "seller" and not include_chars
+        
+        unique_chars = set()
+        self.filtered_chars = []
+        other_chars = []
+        if include_chars:
+            for product in products:
+                unique_chars.update(product.get('characteristics', {}).keys())
+            
+            popular_chars_set = set(popular_chars) if popular_chars else set()
+            self.filtered_chars = sorted([c for c in unique_chars if c in popular_chars_set])
+            other_chars = sorted([c for c in unique_chars if c not in popular_chars_set])
+        self.char_columns = self.filtered_chars + other_chars
+        
+        unique_deliveries = set()
+        for product in products:
+            for d in (product.get('delivery') or {}).get('deliveries', []):
+                if d.get('title'):
+                    unique_deliveries.add(d['title'])
+        self.deliveries = sorted(list(unique_deliveries))
+        
+        self.missing_filtered_chars = False
+        if include_chars and self.filtered_chars:
+            self.missing_filtered_chars = any(
+                not product.get('characteristics', {}).get(filter_char)
+                for product in products for filter_char in self.filtered_chars)
+        
+        fixed_headers = ['Місце в видачі', 'Назва продукта', 'Посилання', 'Пошуковий запит', 'Категорія', 'Бренд', 
+                         'Ціна стара', 'Ціна зараз', 'Відгуки зірки', 'Відгуки кількість', 'Кількість в списках бажань', 
+                         'Продавець', 'Оплата', 'Гарантія', 'Кількість відео', 'Кількість кредитів']
+        if self.seller_extras:
+            fixed_headers.extend(SELLER_EXTRA_HEADERS)
+        self.fixed_count = len(fixed_headers)
+        self.headers = fixed_headers + self.deliveries + (self.char_columns if include_chars else [])
+    
+    def header_style(self, col, header):
+        if header in DARK_GREEN_HEADERS:
+            return 'header_dark_green'
+        if col <= self.fixed_count:
+            return 'header_green'
+        if col <= self.fixed_count + len(self.deliveries):
+            return 'header_orange'
+        if col <= self.fixed_count + len(self.deliveries) + len(self.filtered_chars):
+            return 'header_gray'
+        return 'header_yellow'
+    
+    def rows(self):
+        """Рядки даних по одному, без накопичення в пам'яті"""
+        for idx, product in enumerate(self.products, 1):
+            delivery = product.get('delivery') or {}
+            delivery_dict = {d.get('title', ''): 'безкоштовно' if d.get('cost', '') == 0 else d.get('cost', '') for d in delivery.get('deliveries', [])}
+            
             cat = product.get('category', {})
             if hasattr(cat, 'get'):
-                category = cat.get('title', 'Без категорії')
+                cat_title = cat.get('title', '')
             else:
-                category = str(cat) if cat else 'Без категорії'
-        categories.setdefault(category, []).append(product)
+                cat_title = str(cat) if cat else ''
+            
+            data = [
+                idx, product.get('title', ''), product.get('href', ''), self.search_text,
+                cat_title, product.get('brand', ''),
+                product.get('old_price', ''), product.get('price', ''),
+                product.get('comments_mark', ''), product.get('comments_amount', 0),
+                product.get('wishlist_count', 0), product.get('seller', {}).get('title', ''),
+                delivery.get('payments', ''), product.get('warranty', ''),
+                product.get('videos_count', 0), product.get('credits_count', 0)
+            ]
+            
+            if self.seller_extras:
+                data.append(product.get('product_avg_rating', ''))
+                data.append(product.get('has_grouping', ''))
+                data.append(product.get('grouping_count', ''))
+                data.append(product.get('min_price_in_group', ''))
+                data.append(product.get('sellers_in_group', ''))
+            
+            for delivery_name in self.deliveries:
+                data.append(delivery_dict.get(delivery_name, ''))
+            
+            if self.include_chars:
+                chars = product.get('characteristics', {})
+                for char_key in self.char_columns:
+                    data.append(chars.get(char_key, ''))
+            yield data
+    
+    def column_widths(self):
+        """Ширини колонок (як раніше: найдовше значення + 2, не більше 50)"""
+        max_lengths = [len(str(header or '')) for header in self.headers]
+        for data in self.rows():
+            for col, value in enumerate(data):
+                length = len(str(value or ''))
+                if length > max_lengths[col]:
+                    max_lengths[col] = length
+        return [min(length + 2, 50) for length in max_lengths]
+
+async def export_to_excel(all_products, search_text, filename, include_chars=True, mode="search"):
+    await asyncio.to_thread(write_excel, all_products, search_text, filename, include_chars, mode)
+
+def write_excel(all_products, search_text, filename, include_chars=True, mode="search"):
+    """Потоковий запис книги (openpyxl write-only): рядки одразу йдуть у файл, пам'ять не росте з кількістю рядків"""
+    wb = Workbook(write_only=True)
+    add_export_styles(wb)
+    
+    categories = group_by_category(all_products)
     
     logging.info(f"Знайдено {len(categories)} категорій для розбивки по листам")
     
     for category_name, products in categories.items():
         popular_chars = get_popular_characteristics(products, threshold=350)
         logging.info(f"Створення листа для категорії '{category_name}' ({len(products)} товарів)")
-        await create_sheet_with_data(wb, products, search_text, include_chars, popular_chars, 
-                                    category_name, mode)
+        create_sheet_with_data(wb, products, search_text, include_chars, popular_chars, 
+                               category_name, mode)
     
     wb.save(filename)
     logging.info(f"Excel файл збережено: {filename}")
 
-async def create_sheet_with_data(wb, products, search_text, include_chars, popular_chars, sheet_base_name, mode):
-    unique_chars = set()
-    filtered_chars = []
-    other_chars = []
-    
-    if include_chars:
-        for product in products:
-            unique_chars.update(product.get('characteristics', {}).keys())
-        
-        popular_chars_set = set(popular_chars) if popular_chars else set()
-        filtered_chars = sorted([c for c in unique_chars if c in popular_chars_set])
-        other_chars = sorted([c for c in unique_chars if c not in popular_chars_set])
-    
-    unique_deliveries = set()
-    for product in products:
-        for d in product.get('delivery', {}).get('deliveries', []):
-            if d.get('title'):
-                unique_deliveries.add(d['title'])
-    unique_deliveries = sorted(list(unique_deliveries))
-    
-    missing_filtered_chars = False
-    if include_chars and filtered_chars:
-        for product in products:
-            chars = product.get('characteristics', {})
-            for filter_char in filtered_chars:
-                if not chars.get(filter_char):
-                    missing_filtered_chars = True
-                    break
-            if missing_filtered_chars:
-                break
+def create_sheet_with_data(wb, products, search_text, include_chars, popular_chars, sheet_base_name, mode):
+    layout = SheetLayout(products, search_text, include_chars, popular_chars, mode)
     
     sheet_name = sheet_base_name[:31].replace('/', '_').replace('\\', '_').replace('*', '_').replace('?', '_').replace(':', '_').replace('[', '_').replace(']', '_')
     
-    if include_chars and missing_filtered_chars:
+    if include_chars and layout.missing_filtered_chars:
         sheet_name = f"!!!{sheet_name[:28]}"
     
     base_sheet_name = sheet_name
@@ -707,84 +2035,118 @@ async def create_sheet_with_data(wb, products, search_text, include_chars, popul
     
     ws = wb.create_sheet(title=sheet_name)
     
-    green_fill = PatternFill(start_color="90EE90", end_color="90EE90", fill_type="solid")
-    dark_green_fill = PatternFill(start_color="006400", end_color="006400", fill_type="solid")
-    orange_fill = PatternFill(start_color="FFA500", end_color="FFA500", fill_type="solid")
-    gray_fill = PatternFill(start_color="C0C0C0", end_color="C0C0C0", fill_type="solid")
-    yellow_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+    # write-only лист пише <cols> перед першим рядком, тому ширини рахуються окремим проходом до запису
+    for col, width in enumerate(layout.column_widths(), 1):
+        ws.column_dimensions[get_column_letter(col)].width = width
     
-    fixed_headers = ['Місце в видачі', 'Назва продукта', 'Посилання', 'Пошуковий запит', 'Категорія', 'Бренд', 
-                     'Ціна стара', 'Ціна зараз', 'Відгуки зірки', 'Відгуки кількість', 'Кількість в списках бажань', 
-                     'Продавець', 'Оплата', 'Гарантія', 'Кількість відео', 'Кількість кредитів']
+    header_row = []
+    for col, header in enumerate(layout.headers, 1):
+        cell = WriteOnlyCell(ws, value=header)
+        cell.style = layout.header_style(col, header)
+        header_row.append(cell)
+    ws.append(header_row)
     
-    if mode == "seller" and not include_chars:
-        fixed_headers.extend(['Середня оцінка (перші 3 відгуки)', 'Групування, так/ні', 'Кількість карток у групуванні', 'Мінімальна ціна в групуванні', 'Продавці в групуванні'])
+    for data in layout.rows():
+        row = []
+        for value in data:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = 'cell_center'
+            row.append(cell)
+        ws.append(row)
+
+PARTITION_COLUMN = 'Розділ'
+
+class CsvExportWriter:
+    def __init__(self, filename, columns):
+        self._file = open(filename, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
     
-    headers = fixed_headers + unique_deliveries
-    if include_chars:
-        headers += filtered_chars + other_chars
+    def write(self, row):
+        self._writer.writerow(row)
     
-    fixed_count = len(fixed_headers)
-    delivery_count = len(unique_deliveries)
-    filtered_count = len(filtered_chars)
+    def close(self):
+        self._file.close()
+
+class JsonlExportWriter:
+    def __init__(self, filename, columns):
+        self._file = open(filename, 'w', encoding='utf-8')
+        self._columns = columns
     
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        
-        if header in ['Середня оцінка (перші 3 відгуки)', 'Групування, так/ні', 'Кількість карток у групуванні', 'Мінімальна ціна в групуванні', 'Продавці в групуванні', 'Кількість відео', 'Кількість кредитів']:
-            cell.fill = dark_green_fill
-        elif col <= fixed_count:
-            cell.fill = green_fill
-        elif col <= fixed_count + delivery_count:
-            cell.fill = orange_fill
-        elif col <= fixed_count + delivery_count + filtered_count:
-            cell.fill = gray_fill
-        else:
-            cell.fill = yellow_fill
+    def write(self, row):
+        self._file.write(json.dumps(dict(zip(self._columns, row)), ensure_ascii=False, default=str) + '\n')
     
-    for idx, product in enumerate(products, 1):
-        row = idx + 1
-        delivery_dict = {d.get('title', ''): 'безкоштовно' if d.get('cost', '') == 0 else d.get('cost', '') for d in product.get('delivery', {}).get('deliveries', [])}
-        
-        cat = product.get('category', {})
-        if hasattr(cat, 'get'):
-            cat_title = cat.get('title', '')
-        else:
-            cat_title = str(cat) if cat else ''
-        
-        data = [
-            idx, product.get('title', ''), product.get('href', ''), search_text,
-            cat_title, product.get('brand', ''),
-            product.get('old_price', ''), product.get('price', ''),
-            product.get('comments_mark', ''), product.get('comments_amount', 0),
-            product.get('wishlist_count', 0), product.get('seller', {}).get('title', ''),
-            product.get('delivery', {}).get('payments', ''), product.get('warranty', ''),
-            product.get('videos_count', 0), product.get('credits_count', 0)
-        ]
-        
-        if mode == "seller" and not include_chars:
-            data.append(product.get('product_avg_rating', ''))
-            data.append(product.get('has_grouping', ''))
-            data.append(product.get('grouping_count', ''))
-            data.append(product.get('min_price_in_group', ''))
-            data.append(product.get('sellers_in_group', ''))
-        
-        for delivery_name in unique_deliveries:
-            data.append(delivery_dict.get(delivery_name, ''))
-        
-        if include_chars:
-            chars = product.get('characteristics', {})
-            for char_key in filtered_chars + other_chars:
-                data.append(chars.get(char_key, ''))
-        
-        for col, value in enumerate(data, 1):
-            cell = ws.cell(row=row, column=col, value=value)
-            cell.alignment = Alignment(horizontal='center', vertical='center')
+    def close(self):
+        self._file.close()
+
+class ParquetExportWriter:
+    """Parquet з усіма колонками-рядками; рядки пишуться групами по PARQUET_ROW_GROUP_SIZE"""
+
+    def __init__(self, filename, columns):
+        self._columns = columns
+        self._schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+        self._writer = pyarrow.parquet.ParquetWriter(filename, self._schema)
+        self._batch = []
+    
+    def write(self, row):
+        self._batch.append(['' if value is None else str(value) for value in row])
+        if len(self._batch) >= PARQUET_ROW_GROUP_SIZE:
+            self._flush()
+    
+    def _flush(self):
+        if self._batch:
+            arrays = [pyarrow.array(column, pyarrow.string()) for column in zip(*self._batch)]
+            self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self._schema))
+            self._batch = []
+    
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+EXPORT_WRITERS = {
+    'csv': CsvExportWriter,
+    'jsonl': JsonlExportWriter,
+    'parquet': ParquetExportWriter,
+}
+EXPORT_MEDIA_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+def check_output_format(output_format):
+    if output_format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(400, f"Непідтримуваний формат: {output_format}. Доступні: {', '.join(EXPORT_MEDIA_TYPES)}")
+    if output_format == 'parquet' and pyarrow is None:
+        raise HTTPException(400, "Формат parquet недоступний: не встановлено pyarrow")
+
+def write_table_export(all_products, search_text, filename, include_chars, mode, output_format):
+    """CSV/JSONL/Parquet з тими самими колонками, що й листи Excel; категорія листа — колонка PARTITION_COLUMN.
+
+    Колонки файлу — об'єднання колонок усіх категорій у порядку їх появи; рядки пишуться по одному.
+    """
+    layouts = []
+    for category_name, products in group_by_category(all_products).items():
+        popular_chars = get_popular_characteristics(products, threshold=350)
+        layouts.append((category_name, SheetLayout(products, search_text, include_chars, popular_chars, mode)))
     
-    for column in ws.columns:
-        max_length = max(len(str(cell.value or '')) for cell in column)
-        ws.column_dimensions[column[0].column_letter].width = min(max_length + 2, 50)
+    headers = list(dict.fromkeys(header for _, layout in layouts for header in layout.headers))
+    writer = EXPORT_WRITERS[output_format](filename, [PARTITION_COLUMN] + headers)
+    try:
+        for category_name, layout in layouts:
+            positions = {header: col for col, header in enumerate(layout.headers)}
+            for data in layout.rows():
+                writer.write([category_name] + [data[positions[h]] if h in positions else '' for h in headers])
+    finally:
+        writer.close()
+    logging.info(f"Файл {output_format} збережено: {filename}")
+
+async def export_products(all_products, search_text, filename, include_chars=True, mode="search", output_format="xlsx"):
+    if output_format == "xlsx":
+        await export_to_excel(all_products, search_text, filename, include_chars, mode)
+    else:
+        await asyncio.to_thread(write_table_export, all_products, search_text, filename, include_chars, mode, output_format)
 
 def extract_product_ids_from_urls(urls: List[str]) -> List[int]:
     """Витягує ID товарів з URL"""
@@ -795,6 +2157,353 @@ def extract_product_ids_from_urls(urls: List[str]) -> List[int]:
             product_ids.append(int(match.group(1)))
     return product_ids
 
+async def create_job(job_id, username, kind, params):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    await db.run(db.execute, "INSERT INTO jobs (id, username, kind, params, state, processed, total, created_at, updated_at) VALUES (?, ?, ?, ?, 'queued', 0, 0, ?, ?)",
+                 (job_id, username, kind, json.dumps(params), now, now))
+
+async def update_job(job_id, **fields):
+    fields['updated_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    assignments = ', '.join(f"{name}=?" for name in fields)
+    await db.run(db.execute, f"UPDATE jobs SET {assignments} WHERE id=?", (*fields.values(), job_id))
+
+async def get_job(job_id):
+    row = await db.run(db.fetchone, "SELECT * FROM jobs WHERE id=?", (job_id,))
+    if not row:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    return job
+
+class JobEvents:
+    """Розсилка подій задач підписникам SSE; кожен підписник має власну обмежену чергу"""
+
+    def __init__(self):
+        self._subscribers = {}
+
+    def subscribe(self, job_id):
+        subscriber = asyncio.Queue(maxsize=JOB_EVENTS_QUEUE_SIZE)
+        self._subscribers.setdefault(job_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, job_id, subscriber):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def publish(self, job_id, event):
+        for subscriber in self._subscribers.get(job_id, ()):
+            if subscriber.full():
+                subscriber.get_nowait()
+            subscriber.put_nowait(event)
+
+job_events = JobEvents()
+
+class JobProgress:
+    """Лічильники прогресу задачі.
+
+    Кожна зміна публікується в job_events для SSE, а в users.db записується не частіше
+    ніж раз на JOB_PROGRESS_FLUSH_INTERVAL.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.pages = 0
+        self.batches = 0
+        self.processed = 0
+        self.total = 0
+        self.reenriched = 0
+        self.reused = 0
+        self._flushed_at = 0.0
+
+    def snapshot(self):
+        return {
+            'pages': self.pages,
+            'batches': self.batches,
+            'processed': self.processed,
+            'total': self.total,
+            'reenriched': self.reenriched,
+            'reused': self.reused,
+            'selenium_queue': selenium_executor.queued if selenium_executor else 0,
+        }
+
+    def emit(self, stage, **data):
+        job_events.publish(self.job_id, {'stage': stage, **self.snapshot(), **data})
+
+    async def add_page(self, count):
+        self.pages += 1
+        self.total += count
+        self.emit('listing')
+        await self._maybe_flush()
+
+    def add_batch(self):
+        self.batches += 1
+        self.emit('details')
+
+    async def add_processed(self, count=1):
+        self.processed += count
+        self.emit('enriched')
+        await self._maybe_flush()
+
+    def add_enrichment(self, reused):
+        """Товар збагачено заново (reused=False) чи повністю взято зі знімка минулого запуску"""
+        if reused:
+            self.reused += 1
+        else:
+            self.reenriched += 1
+
+    async def _maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= JOB_PROGRESS_FLUSH_INTERVAL:
+            await self.flush()
+
+    async def flush(self):
+        self._flushed_at = time.monotonic()
+        await update_job(self.job_id, processed=self.processed, total=self.total,
+                         reenriched=self.reenriched, reused=self.reused)
+
+class JobCheckpoint:
+    """Контрольна точка задачі в users.db: пройдені сторінки видачі з їх id і вже збагачені товари.
+
+    Збагачені товари пишуться пачками по JOB_CHECKPOINT_BATCH; при відновленні задача бере сторінки
+    і товари звідси замість повторних запитів.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.pages = {}
+        self.products = {}
+        self._pending = []
+
+    def load(self):
+        rows = db.fetchall("SELECT page, product_ids FROM job_pages WHERE job_id=?", (self.job_id,))
+        self.pages = {page: json.loads(product_ids) for page, product_ids in rows if json.loads(product_ids)}
+        rows = db.fetchall("SELECT product_id, product FROM job_products WHERE job_id=?", (self.job_id,))
+        self.products = {product_id: json.loads(product) for product_id, product in rows}
+        return self
+
+    async def page_ids(self, page, fetch_page_ids):
+        """id сторінки з контрольної точки; інакше fetch_page_ids (список або корутина-функція) з фіксацією результату.
+
+        Порожня сторінка не фіксується: завантажувачі видачі повертають [] і при помилці запиту,
+        тож при відновленні таку сторінку треба запитати знову.
+        """
+        if page in self.pages:
+            return self.pages[page]
+        product_ids = fetch_page_ids if isinstance(fetch_page_ids, list) else await fetch_page_ids(page)
+        if not product_ids:
+            return product_ids
+        self.pages[page] = product_ids
+        await db.run(db.execute, "INSERT OR REPLACE INTO job_pages (job_id, page, product_ids) VALUES (?, ?, ?)",
+                     (self.job_id, page, json.dumps(product_ids)))
+        return product_ids
+
+    def wrap_page_fetcher(self, fetch_page_ids):
+        async def fetch(page):
+            return await self.page_ids(page, fetch_page_ids)
+        return fetch
+
+    async def add_product(self, product):
+        self._pending.append(product)
+        if len(self._pending) >= JOB_CHECKPOINT_BATCH:
+            await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, []
+        if pending:
+            await db.run(self._save_products, pending)
+
+    def _save_products(self, products):
+        db.executemany("INSERT OR REPLACE INTO job_products (job_id, product_id, product) VALUES (?, ?, ?)",
+                       [(self.job_id, str(p.get('id')), json.dumps(p, ensure_ascii=False)) for p in products])
+        for product in products:
+            self.products[str(product.get('id'))] = product
+
+    def clear(self):
+        with db.transaction() as conn:
+            conn.execute("DELETE FROM job_pages WHERE job_id=?", (self.job_id,))
+            conn.execute("DELETE FROM job_products WHERE job_id=?", (self.job_id,))
+
+    @staticmethod
+    def purge_failed(days=JOB_CHECKPOINT_RETENTION_DAYS):
+        """Видаляє контрольні точки задач, що впали понад days днів тому й так і не були відновлені"""
+        cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        stale = "SELECT id FROM jobs WHERE state='failed' AND updated_at < ?"
+        with db.transaction() as conn:
+            pages = conn.execute(f"DELETE FROM job_pages WHERE job_id IN ({stale})", (cutoff,)).rowcount
+            products = conn.execute(f"DELETE FROM job_products WHERE job_id IN ({stale})", (cutoff,)).rowcount
+        return pages + products
+
+class JobManager:
+    """Фонове виконання парсингів: задачі стають у чергу і виконуються JOB_WORKERS воркерами застосунку"""
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self.running = 0
+        self._queue = None
+        self._pending = []
+        self._admit_lock = None
+        self._tasks = []
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._admit_lock = asyncio.Lock()
+        await db.run(db.execute, "UPDATE jobs SET state='failed', error='Перервано перезапуском сервера' WHERE state='running'")
+        purged = await db.run(JobCheckpoint.purge_failed)
+        if purged:
+            logging.info(f"Видалено застарілих контрольних точок: {purged} рядків")
+        queued = [row[0] for row in await db.run(db.fetchall, "SELECT id FROM jobs WHERE state='queued' ORDER BY created_at")]
+        for job_id in queued:
+            self._enqueue(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Менеджер задач запущено: {self.workers} воркерів, у черзі {len(queued)}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def submit(self, username, kind, params):
+        job_id = uuid.uuid4().hex
+        await create_job(job_id, username, kind, params)
+        self._enqueue(job_id)
+        logging.info(f"Задача {job_id} ({kind}) поставлена в чергу, позиція {self.position(job_id)}")
+        return job_id
+
+    async def resume(self, job_id):
+        """Повертає перервану задачу в чергу; виконання продовжиться з її контрольної точки"""
+        await update_job(job_id, state='queued', error=None)
+        self._enqueue(job_id)
+        logging.info(f"Задача {job_id} відновлюється з контрольної точки")
+
+    def _enqueue(self, job_id):
+        self._pending.append(job_id)
+        self._queue.put_nowait(job_id)
+
+    def position(self, job_id):
+        """Позиція задачі в черзі (1 — наступна на виконання) або None, якщо вона не чекає"""
+        try:
+            return self._pending.index(job_id) + 1
+        except ValueError:
+            return None
+
+    def _publish_positions(self):
+        for position, job_id in enumerate(self._pending, 1):
+            job_events.publish(job_id, {'stage': 'queued', 'queue_position': position})
+
+    async def _worker(self):
+        while True:
+            # допуск по черзі: поки голова черги чекає на пам'ять, наступні задачі її не обганяють
+            async with self._admit_lock:
+                job_id = await self._queue.get()
+                await admission.admit_job(lambda: self.running)
+                self._pending.remove(job_id)
+                self.running += 1
+            self._publish_positions()
+            try:
+                await self._run(job_id)
+            finally:
+                self.running -= 1
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queued': len(self._pending),
+            'running': self.running,
+        }
+
+    async def _run(self, job_id):
+        job = await get_job(job_id)
+        if not job or job['state'] != 'queued':
+            return
+        await update_job(job_id, state='running')
+        progress = JobProgress(job_id)
+        progress.emit('running')
+        try:
+            checkpoint = await db.run(JobCheckpoint(job_id).load)
+            if checkpoint.pages or checkpoint.products:
+                logging.info(f"Задача {job_id}: контрольна точка — {len(checkpoint.pages)} сторінок, {len(checkpoint.products)} товарів")
+            result = await JOB_RUNNERS[job['kind']](job['params'], progress, checkpoint)
+            await update_job(job_id, state='done', filename=result['filename'],
+                       processed=result['count'], total=max(progress.total, result['count']),
+                       reenriched=progress.reenriched, reused=progress.reused)
+            await db.run(checkpoint.clear)
+            progress.emit('done', filename=result['filename'])
+            logging.info(f"Задача {job_id} завершена: {result['filename']} (збагачено заново: {progress.reenriched}, без змін: {progress.reused})")
+        except asyncio.CancelledError:
+            await update_job(job_id, state='failed', error='Перервано зупинкою сервера')
+            progress.emit('failed', error='Перервано зупинкою сервера')
+            raise
+        except Exception as e:
+            logging.error(f"Помилка задачі {job_id}: {e}")
+            await update_job(job_id, state='failed', error=str(e))
+            progress.emit('failed', error=str(e))
+
+job_manager = JobManager()
+
+PRICE_HISTORY_COLUMNS = ['checked_at', 'favorite_id', 'product_id', 'price', 'old_price', 'sell_status', 'seller', 'comments_amount', 'wishlist_count']
+
+def save_price_history(favorite_id, checked_at, products, wishlist_counts):
+    db.executemany(
+        "INSERT INTO price_history (favorite_id, product_id, checked_at, price, old_price, sell_status, seller, comments_amount, wishlist_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(favorite_id, p.get('id'), checked_at, p.get('price'), p.get('old_price'), p.get('sell_status'),
+          (p.get('seller') or {}).get('title'), p.get('comments_amount'), wishlist_counts.get(p.get('id'), 0))
+         for p in products])
+
+class FavoritesMonitor:
+    """Планувальник моніторингу збережених списків.
+
+    Раз на MONITOR_TICK перевіряє списки з monitor_interval > 0 і для тих, у кого настав час,
+    знімає ціну/наявність легким шляхом: свіжий getDetails і wishlist пачками, без Selenium
+    та сторінок товарів. Результати дописуються в price_history.
+    """
+
+    def __init__(self, tick=MONITOR_TICK):
+        self.tick = tick
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def _due_lists(self):
+        now = datetime.now()
+        rows = db.fetchall("SELECT id, name, urls, monitor_interval, monitor_last_run FROM favorites WHERE monitor_interval > 0")
+        due = []
+        for favorite_id, name, urls_json, interval, last_run in rows:
+            if last_run and datetime.strptime(last_run, "%Y-%m-%d %H:%M:%S") + timedelta(minutes=interval) > now:
+                continue
+            due.append((favorite_id, name, json.loads(urls_json)))
+        return due
+
+    async def _loop(self):
+        while True:
+            try:
+                for favorite_id, name, urls in await db.run(self._due_lists):
+                    await self.refresh(favorite_id, name, urls)
+            except Exception as e:
+                logging.error(f"Помилка моніторингу: {e}")
+            await asyncio.sleep(self.tick)
+
+    async def refresh(self, favorite_id, name, urls):
+        checked_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        product_ids = extract_product_ids_from_urls(urls)
+        saved = 0
+        for start in range(0, len(product_ids), DETAILS_BATCH_SIZE):
+            products = await fetch_details_remote(http_client, product_ids[start:start + DETAILS_BATCH_SIZE])
+            wishlist_counts = await fetch_wishlist_counts(http_client, [p.get('id') for p in products if p.get('id')])
+            await db.run(save_price_history, favorite_id, checked_at, products, wishlist_counts)
+            saved += len(products)
+        await db.run(db.execute, "UPDATE favorites SET monitor_last_run=? WHERE id=?", (checked_at, favorite_id))
+        logging.info(f"Моніторинг '{name}': збережено {saved}/{len(product_ids)} цін")
+
+favorites_monitor = FavoritesMonitor()
+
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
     css = """
@@ -822,25 +2531,25 @@ async def root(request: Request, current_user: Optional[Dict[str, str]] = Depend
     </style>
     """
     if current_user:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT id, name, urls, created_at FROM favorites WHERE username=?", (current_user['username'],))
-        favorites = c.fetchall()
-        conn.close()
+        favorites = await db.run(db.fetchall, "SELECT id, name, urls, created_at, monitor_interval FROM favorites WHERE username=?",
+                                 (current_user['username'],))
         
         favorites_html = ""
         if favorites:
             favorites_html = '<div class="favorites-list">'
-            for fav_id, name, urls_json, created_at in favorites:
+            for fav_id, name, urls_json, created_at, monitor_interval in favorites:
                 urls = json.loads(urls_json)
+                monitor_text = f" | моніторинг кожні {monitor_interval} хв" if monitor_interval else ""
                 favorites_html += f'''
                 <div class="favorite-item">
                     <div>
                         <strong>{name}</strong><br>
-                        <small>{len(urls)} товарів | {created_at}</small>
+                        <small>{len(urls)} товарів | {created_at}{monitor_text}</small>
                     </div>
                     <div>
                         <button class="secondary" onclick="runFavorite({fav_id})">Парсити</button>
+                        <button class="secondary" onclick="setMonitor({fav_id}, {monitor_interval or 0})">Моніторинг</button>
+                        <button class="secondary" onclick="window.location.href='/api/history?favorite_id={fav_id}'">Історія цін</button>
                         <button class="danger" onclick="deleteFavorite({fav_id})">Видалити</button>
                     </div>
                 </div>
@@ -896,6 +2605,82 @@ async def root(request: Request, current_user: Optional[Dict[str, str]] = Depend
                     status.style.display = 'block';
                 }}
                 
+                async function followJob(res) {{
+                    const data = await res.json();
+                    if (!data.job_id) {{
+                        showStatus('Помилка: ' + (data.error || data.detail));
+                        return;
+                    }}
+                    watchJob(data.job_id);
+                }}
+                
+                function renderProgress(e) {{
+                    const parts = [];
+                    if (e.stage === 'queued') parts.push(e.queue_position ? `В черзі, позиція ${{e.queue_position}}` : 'В черзі');
+                    if (e.pages) parts.push(`Сторінок видачі: ${{e.pages}}`);
+                    if (e.batches) parts.push(`Пачок деталей: ${{e.batches}}`);
+                    parts.push(`Оброблено: ${{e.processed || 0}}/${{e.total || 0}}`);
+                    if (e.reused) parts.push(`Без змін: ${{e.reused}}, оновлено: ${{e.reenriched || 0}}`);
+                    if (e.selenium_queue) parts.push(`Черга Selenium: ${{e.selenium_queue}}`);
+                    if (e.stage === 'export') parts.push(e.state === 'started' ? 'Формування файлу...' : 'Файл сформовано');
+                    showStatus(parts.join(' | '));
+                }}
+                
+                function watchJob(jobId) {{
+                    const source = new EventSource('/api/jobs/' + jobId + '/events');
+                    source.onmessage = (msg) => {{
+                        const e = JSON.parse(msg.data);
+                        if (e.stage === 'done') {{
+                            source.close();
+                            showStatus('Готово!');
+                            window.location.href = '/download/' + e.filename;
+                            return;
+                        }}
+                        if (e.stage === 'failed') {{
+                            source.close();
+                            showFailure(jobId, e.error);
+                            return;
+                        }}
+                        renderProgress(e);
+                    }};
+                    source.onerror = () => {{
+                        source.close();
+                        pollJob(jobId);
+                    }};
+                }}
+                
+                async function pollJob(jobId) {{
+                    const res = await fetch('/api/jobs/' + jobId);
+                    const job = await res.json();
+                    if (job.state === 'done') {{
+                        showStatus('Готово!');
+                        window.location.href = '/download/' + job.filename;
+                        return;
+                    }}
+                    if (job.state === 'failed') {{
+                        showFailure(jobId, job.error);
+                        return;
+                    }}
+                    const stateText = job.state === 'queued' ? `В черзі (позиція ${{job.queue_position || '-'}})` : 'Обробка';
+                    showStatus(`${{stateText}}: ${{job.processed}}/${{job.total}} товарів`);
+                    setTimeout(() => pollJob(jobId), 2000);
+                }}
+                
+                function showFailure(jobId, error) {{
+                    showStatus('Помилка: ' + error);
+                    const button = document.createElement('button');
+                    button.className = 'secondary';
+                    button.textContent = 'Продовжити з контрольної точки';
+                    button.onclick = () => resumeJob(jobId);
+                    document.getElementById('status').appendChild(button);
+                }}
+                
+                async function resumeJob(jobId) {{
+                    showStatus('Відновлення...');
+                    const res = await fetch('/api/jobs/' + jobId + '/resume', {{method: 'POST'}});
+                    await followJob(res);
+                }}
+                
                 async function runSearch() {{
                     const url = document.getElementById('searchUrl').value;
                     const includeChars = document.getElementById('searchChars').checked;
@@ -908,13 +2693,7 @@ async def root(request: Request, current_user: Optional[Dict[str, str]] = Depend
                         headers: {{'Content-Type': 'application/json'}},
                         body: JSON.stringify({{url, include_chars: includeChars, max_pages: maxPages}})
                     }});
-                    const data = await res.json();
-                    if (data.filename) {{
-                        showStatus('Готово!');
-                        window.location.href = '/download/' + data.filename;
-                    }} else {{
-                        showStatus('Помилка: ' + data.error);
-                    }}
+                    await followJob(res);
                 }}
                 
                 async function runSeller() {{
@@ -936,13 +2715,7 @@ async def root(request: Request, current_user: Optional[Dict[str, str]] = Depend
                         headers: {{'Content-Type': 'application/json'}},
                         body: JSON.stringify({{seller_name: sellerName, include_chars: includeChars, max_pages: maxPages}})
                     }});
-                    const data = await res.json();
-                    if (data.filename) {{
-                        showStatus('Готово!');
-                        window.location.href = '/download/' + data.filename;
-                    }} else {{
-                        showStatus('Помилка: ' + data.error);
-                    }}
+                    await followJob(res);
                 }}
                 
                 async function saveFavorite() {{
@@ -997,13 +2770,7 @@ async def root(request: Request, current_user: Optional[Dict[str, str]] = Depend
                         headers: {{'Content-Type': 'application/json'}},
                         body: JSON.stringify({{urls, include_chars: includeChars}})
                     }});
-                    const data = await res.json();
-                    if (data.filename) {{
-                        showStatus('Готово!');
-                        window.location.href = '/download/' + data.filename;
-                    }} else {{
-                        showStatus('Помилка: ' + data.error);
-                    }}
+                    await followJob(res);
                 }}
                 
                 async function runFavorite(favoriteId) {{
@@ -1011,12 +2778,22 @@ async def root(request: Request, current_user: Optional[Dict[str, str]] = Depend
                     const res = await fetch('/api/favorites/parse/' + favoriteId, {{
                         method: 'POST'
                     }});
+                    await followJob(res);
+                }}
+                
+                async function setMonitor(favoriteId, current) {{
+                    const value = prompt('Інтервал моніторингу цін, хв (0 — вимкнути):', current || 60);
+                    if (value === null) return;
+                    const res = await fetch('/api/favorites/' + favoriteId + '/monitor', {{
+                        method: 'POST',
+                        headers: {{'Content-Type': 'application/json'}},
+                        body: JSON.stringify({{interval_minutes: parseInt(value) || 0}})
+                    }});
                     const data = await res.json();
-                    if (data.filename) {{
-                        showStatus('Готово!');
-                        window.location.href = '/download/' + data.filename;
+                    if (data.success) {{
+                        location.reload();
                     }} else {{
-                        showStatus('Помилка: ' + data.error);
+                        alert('Помилка: ' + (data.error || data.detail));
                     }}
                 }}
                 
@@ -1074,16 +2851,10 @@ async def root(request: Request, current_user: Optional[Dict[str, str]] = Depend
 
 @app.post("/register")
 async def register(username: str = Form(), password: str = Form()):
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("SELECT id FROM users WHERE username=?", (username,))
-    if c.fetchone():
-        conn.close()
+    if await db.run(db.fetchone, "SELECT id FROM users WHERE username=?", (username,)):
         raise HTTPException(400, "Користувач існує")
     pw_hash = hash_password(password)
-    c.execute("INSERT INTO users (username, password_hash, status) VALUES (?, ?, 'pending')", (username, pw_hash))
-    conn.commit()
-    conn.close()
+    await db.run(db.execute, "INSERT INTO users (username, password_hash, status) VALUES (?, ?, 'pending')", (username, pw_hash))
     css = """
     <style>
     body { background: #ffffff; color: #333; font-family: Arial; max-width: 600px; margin: 50px auto; padding: 20px; text-align: center; }
@@ -1174,11 +2945,7 @@ async def register(username: str = Form(), password: str = Form()):
 
 @app.get("/check-status/{username}")
 async def check_status(username: str):
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("SELECT status FROM users WHERE username=?", (username,))
-    row = c.fetchone()
-    conn.close()
+    row = await db.run(db.fetchone, "SELECT status FROM users WHERE username=?", (username,))
     if row:
         return {"status": row[0]}
     return {"status": "not_found"}
@@ -1189,11 +2956,7 @@ async def auto_login(request: Request):
     username = data.get('username')
     password = data.get('password')
     
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("SELECT password_hash, status FROM users WHERE username=?", (username,))
-    row = c.fetchone()
-    conn.close()
+    row = await db.run(db.fetchone, "SELECT password_hash, status FROM users WHERE username=?", (username,))
     
     if not row or not verify_password(password, row[0]):
         raise HTTPException(400, "Невірні дані")
@@ -1207,11 +2970,7 @@ async def auto_login(request: Request):
 
 @app.post("/login")
 async def login(username: str = Form(), password: str = Form()):
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("SELECT password_hash, status FROM users WHERE username=?", (username,))
-    row = c.fetchone()
-    conn.close()
+    row = await db.run(db.fetchone, "SELECT password_hash, status FROM users WHERE username=?", (username,))
     if not row or not verify_password(password, row[0]):
         raise HTTPException(400, "Невірні дані")
     status = row[1]
@@ -1239,10 +2998,7 @@ async def admin_page(request: Request, current_user: Optional[Dict[str, str]] =
         <p>Користувачі:</p>
         <ul>
     """
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("SELECT username, status FROM users WHERE status != 'admin'")
-    for row in c.fetchall():
+    for row in await db.run(db.fetchall, "SELECT username, status FROM users WHERE status != 'admin'"):
         username, status = row
         html += f"<li>{username} ({status}) "
         if status == 'pending':
@@ -1255,29 +3011,20 @@ async def admin_page(request: Request, current_user: Optional[Dict[str, str]] =
     </body>
     </html>
     """
-    conn.close()
     return HTMLResponse(content=html)
 
 @app.post("/accept/{username}")
 async def accept_user(username: str, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
     if not current_user or current_user['username'] != "admin1":
         raise HTTPException(403, "Тільки для адміна")
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("UPDATE users SET status='accepted' WHERE username=?", (username,))
-    conn.commit()
-    conn.close()
+    await db.run(db.execute, "UPDATE users SET status='accepted' WHERE username=?", (username,))
     return RedirectResponse(url="/admin", status_code=303)
 
 @app.post("/reject/{username}")
 async def reject_user(username: str, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
     if not current_user or current_user['username'] != "admin1":
         raise HTTPException(403, "Тільки для адміна")
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("UPDATE users SET status='rejected' WHERE username=?", (username,))
-    conn.commit()
-    conn.close()
+    await db.run(db.execute, "UPDATE users SET status='rejected' WHERE username=?", (username,))
     return RedirectResponse(url="/admin", status_code=303)
 
 @app.post("/delete/{username}")
@@ -1288,11 +3035,7 @@ async def delete_user(username: str, current_user: Optional[Dict[str, str]] = De
     if username == current_user['username']:
         response = RedirectResponse(url="/", status_code=303)
         response.delete_cookie("token")
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("DELETE FROM users WHERE username=?", (username,))
-    conn.commit()
-    conn.close()
+    await db.run(db.execute, "DELETE FROM users WHERE username=?", (username,))
     return response
 
 @app.post("/api/favorites/save")
@@ -1300,14 +3043,10 @@ async def save_favorite(req: FavoriteRequest, current_user: Optional[Dict[str, s
     if not current_user:
         raise HTTPException(401, "Не авторизовано")
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
         urls_json = json.dumps(req.urls)
         created_at = datetime.now().strftime("%Y-%m-%d %H:%M")
-        c.execute("INSERT INTO favorites (username, name, urls, created_at) VALUES (?, ?, ?, ?)",
-                  (current_user['username'], req.name, urls_json, created_at))
-        conn.commit()
-        conn.close()
+        await db.run(db.execute, "INSERT INTO favorites (username, name, urls, created_at, delivery_city_id) VALUES (?, ?, ?, ?, ?)",
+                     (current_user['username'], req.name, urls_json, created_at, req.delivery_city_id))
         return {"success": True}
     except Exception as e:
         logging.error(f"Помилка збереження: {e}")
@@ -1317,94 +3056,132 @@ async def save_favorite(req: FavoriteRequest, current_user: Optional[Dict[str, s
 async def parse_favorite_quick(request: Request, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
     if not current_user:
         raise HTTPException(401, "Не авторизовано")
+    data = await request.json()
+    urls = data.get('urls', [])
+    output_format = data.get('output_format') or OUTPUT_FORMAT
+    check_output_format(output_format)
     try:
-        data = await request.json()
-        urls = data.get('urls', [])
-        include_chars = data.get('include_chars', True)
-        
-        product_ids = extract_product_ids_from_urls(urls)
-        if not product_ids:
-            raise HTTPException(400, "Не знайдено валідних ID товарів")
-        
-        session = cloudscraper.create_scraper()
-        session.headers.update(HEADERS)
-        
-        executor = ThreadPoolExecutor(max_workers=10)
-        all_products = []
-        
-        batch_size = 60
-        for i in range(0, len(product_ids), batch_size):
-            batch = product_ids[i:i + batch_size]
-            details = await fetch_details(session, batch)
-            tasks = [process_product(session, p, executor, include_chars, "favorites") for p in details]
-            batch_results = await asyncio.gather(*tasks)
-            all_products.extend(batch_results)
-        
-        executor.shutdown(wait=True)
-        
-        filename = f"downloads/rozetka_favorites_{uuid.uuid4().hex[:8]}.xlsx"
-        await export_to_excel(all_products, "Обрані товари", filename, include_chars, "favorites")
-        
-        return {"filename": os.path.basename(filename), "count": len(all_products)}
-    except Exception as e:
-        logging.error(f"Помилка: {e}")
-        raise HTTPException(500, str(e))
+        delivery_city_id = normalize_city_id(data.get('delivery_city_id') or DELIVERY_CITY_ID)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    
+    product_ids = extract_product_ids_from_urls(urls)
+    if not product_ids:
+        raise HTTPException(400, "Не знайдено валідних ID товарів")
+    
+    job_id = await job_manager.submit(current_user['username'], "favorites", {
+        'name': "Обрані товари",
+        'product_ids': product_ids,
+        'include_chars': data.get('include_chars', True),
+        'extraction_engine': data.get('extraction_engine', EXTRACTION_ENGINE),
+        'delivery_city_id': delivery_city_id,
+        'output_format': output_format,
+    })
+    return {"job_id": job_id}
 
 @app.post("/api/favorites/parse/{favorite_id}")
-async def parse_favorite(favorite_id: int, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
+async def parse_favorite(favorite_id: int, output_format: str = OUTPUT_FORMAT, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(401, "Не авторизовано")
+    check_output_format(output_format)
+    row = await db.run(db.fetchone, "SELECT name, urls, delivery_city_id FROM favorites WHERE id=? AND username=?",
+                       (favorite_id, current_user['username']))
+    
+    if not row:
+        raise HTTPException(404, "Список не знайдено")
+    
+    name, urls_json, delivery_city_id = row
+    product_ids = extract_product_ids_from_urls(json.loads(urls_json))
+    if not product_ids:
+        raise HTTPException(400, "Не знайдено валідних ID товарів")
+    
+    job_id = await job_manager.submit(current_user['username'], "favorites", {
+        'name': name,
+        'product_ids': product_ids,
+        'include_chars': True,
+        'extraction_engine': EXTRACTION_ENGINE,
+        'delivery_city_id': delivery_city_id or DELIVERY_CITY_ID,
+        'output_format': output_format,
+    })
+    return {"job_id": job_id}
+
+@app.post("/api/favorites/{favorite_id}/monitor")
+async def set_favorite_monitor(favorite_id: int, req: MonitorRequest, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
     if not current_user:
         raise HTTPException(401, "Не авторизовано")
+    if req.interval_minutes and req.interval_minutes < MONITOR_MIN_INTERVAL:
+        raise HTTPException(400, f"Мінімальний інтервал моніторингу — {MONITOR_MIN_INTERVAL} хв")
+    updated = await db.run(db.execute, "UPDATE favorites SET monitor_interval=? WHERE id=? AND username=?",
+                           (max(req.interval_minutes, 0), favorite_id, current_user['username']))
+    if not updated:
+        raise HTTPException(404, "Список не знайдено")
+    return {"success": True, "interval_minutes": max(req.interval_minutes, 0)}
+
+def iter_price_history(username, favorite_id, product_id, date_from, date_to, output_format):
+    """Рядки історії цін для StreamingResponse; курсор читається порціями HISTORY_FETCH_SIZE"""
+    query = ("SELECT h.checked_at, h.favorite_id, h.product_id, h.price, h.old_price, h.sell_status, h.seller, h.comments_amount, h.wishlist_count "
+             "FROM price_history h JOIN favorites f ON f.id = h.favorite_id WHERE f.username=?")
+    args = [username]
+    if favorite_id is not None:
+        query += " AND h.favorite_id=?"
+        args.append(favorite_id)
+    if product_id is not None:
+        query += " AND h.product_id=?"
+        args.append(product_id)
+    if date_from:
+        query += " AND h.checked_at>=?"
+        args.append(date_from)
+    if date_to:
+        query += " AND h.checked_at<=?"
+        args.append(date_to + " 23:59:59" if len(date_to) == 10 else date_to)
+    query += " ORDER BY h.checked_at, h.product_id"
+    
+    conn = db.connect(check_same_thread=False)
     try:
-        conn = sqlite3.connect("users.db")
         c = conn.cursor()
-        c.execute("SELECT name, urls FROM favorites WHERE id=? AND username=?", (favorite_id, current_user['username']))
-        row = c.fetchone()
+        c.execute(query, args)
+        if output_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(PRICE_HISTORY_COLUMNS)
+            while rows := c.fetchmany(HISTORY_FETCH_SIZE):
+                writer.writerows(rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            while rows := c.fetchmany(HISTORY_FETCH_SIZE):
+                yield ''.join(json.dumps(dict(zip(PRICE_HISTORY_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows)
+    finally:
         conn.close()
-        
-        if not row:
-            raise HTTPException(404, "Список не знайдено")
-        
-        name, urls_json = row
-        urls = json.loads(urls_json)
-        
-        product_ids = extract_product_ids_from_urls(urls)
-        if not product_ids:
-            raise HTTPException(400, "Не знайдено валідних ID товарів")
-        
-        session = cloudscraper.create_scraper()
-        session.headers.update(HEADERS)
-        
-        executor = ThreadPoolExecutor(max_workers=10)
-        all_products = []
-        
-        batch_size = 60
-        for i in range(0, len(product_ids), batch_size):
-            batch = product_ids[i:i + batch_size]
-            details = await fetch_details(session, batch)
-            tasks = [process_product(session, p, executor, True, "favorites") for p in details]
-            batch_results = await asyncio.gather(*tasks)
-            all_products.extend(batch_results)
-        
-        executor.shutdown(wait=True)
-        
-        filename = f"downloads/rozetka_{name.replace(' ', '_')}_{uuid.uuid4().hex[:8]}.xlsx"
-        await export_to_excel(all_products, name, filename, True, "favorites")
-        
-        return {"filename": os.path.basename(filename), "count": len(all_products)}
-    except Exception as e:
-        logging.error(f"Помилка: {e}")
-        raise HTTPException(500, str(e))
+
+@app.get("/api/history")
+async def price_history(favorite_id: Optional[int] = None, product_id: Optional[int] = None,
+                        date_from: Optional[str] = None, date_to: Optional[str] = None, output_format: str = "csv",
+                        current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(401, "Не авторизовано")
+    if favorite_id is None and product_id is None:
+        raise HTTPException(400, "Вкажіть favorite_id або product_id")
+    if output_format not in ('csv', 'jsonl'):
+        raise HTTPException(400, "Історія експортується у форматах csv або jsonl")
+    name = f"price_history_{favorite_id or ''}_{product_id or ''}.{output_format}".replace('__', '_')
+    return StreamingResponse(iter_price_history(current_user['username'], favorite_id, product_id, date_from, date_to, output_format),
+                             media_type=EXPORT_MEDIA_TYPES[output_format],
+                             headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
+def delete_favorite_rows(favorite_id, username):
+    with db.transaction() as conn:
+        if conn.execute("DELETE FROM favorites WHERE id=? AND username=?", (favorite_id, username)).rowcount:
+            conn.execute("DELETE FROM price_history WHERE favorite_id=?", (favorite_id,))
 
 @app.delete("/api/favorites/delete/{favorite_id}")
 async def delete_favorite(favorite_id: int, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
     if not current_user:
         raise HTTPException(401, "Не авторизовано")
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("DELETE FROM favorites WHERE id=? AND username=?", (favorite_id, current_user['username']))
-        conn.commit()
-        conn.close()
+        await db.run(delete_favorite_rows, favorite_id, current_user['username'])
         return {"success": True}
     except Exception as e:
         logging.error(f"Помилка: {e}")
@@ -1415,9 +3192,8 @@ async def fetch_category_page(session, category_id, page=1):
         url = f"https://catalog-api.rozetka.com.ua/v0.1/api/category/catalog?country=UA&lang=ua&id={category_id}&filters=page:{page}"
         logging.info(f"Отримання сторінки категорії: {url}")
         
-        response = session.get(url, timeout=15)
+        response = await session.get(url, timeout=15)
         response.raise_for_status()
-        await asyncio.sleep(random.uniform(0.2, 0.3))
         data = response.json().get('data', {})
         return {
             'product_ids': data.get('goods', {}).get('ids', []),
@@ -1427,139 +3203,263 @@ async def fetch_category_page(session, category_id, page=1):
         logging.error(f"Помилка категорії (спробуємо пошук): {e}")
         return {'product_ids': [], 'total_pages': 1, 'fallback': True}
 
+async def crawl_listing_pages(fetch_page_ids, first_page_ids, total_pages, concurrency=LISTING_CONCURRENCY):
+    """Віддає (сторінка, id товарів) у порядку видачі.
+
+    Сторінки 2..total_pages завантажуються ковзним вікном з concurrency запитів.
+    Обхід зупиняється на першій порожній сторінці, id, що повторюються між сторінками, відкидаються.
+    """
+    seen = set()
+
+    def unique(ids):
+        new_ids = [pid for pid in ids if pid not in seen]
+        seen.update(new_ids)
+        return new_ids
+
+    yield 1, unique(first_page_ids)
+
+    pending = deque()
+    next_page = 2
+    try:
+        while pending or next_page <= total_pages:
+            while next_page <= total_pages and len(pending) < concurrency:
+                pending.append((next_page, asyncio.ensure_future(fetch_page_ids(next_page))))
+                next_page += 1
+            page, task = pending.popleft()
+            page_ids = await task
+            if not page_ids:
+                logging.warning(f"Сторінка {page} порожня, зупиняємо парсинг")
+                return
+            yield page, unique(page_ids)
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+async def iter_listing_ids(fetch_page_ids, first_page_ids, total_pages, checkpoint=None):
+    """id товарів посторінково; з checkpoint вже пройдені сторінки беруться зі збереженого, а не з API"""
+    if checkpoint:
+        first_page_ids = await checkpoint.page_ids(1, first_page_ids)
+        fetch_page_ids = checkpoint.wrap_page_fetcher(fetch_page_ids)
+    collected = 0
+    async for page, page_ids in crawl_listing_pages(fetch_page_ids, first_page_ids, total_pages):
+        collected += len(page_ids)
+        logging.info(f"Сторінка {page}/{total_pages}: зібрано {len(page_ids)} товарів (всього: {collected})")
+        yield page_ids
+
+
+async def fetch_seller_api(session, seller_name, page=1):
+    url = f"https://search.rozetka.com.ua/ua/seller/api/v7/?front-type=xl&country=UA&lang=ua&name={seller_name}&page={page}"
+    response = await session.get(url, timeout=15)
+    response.raise_for_status()
+    data = response.json().get('data', {})
+    return {
+        'seller_title': data.get('seller_info', {}).get('title', ''),
+        'product_ids': [item.get('id') for item in data.get('goods', []) if item.get('id')],
+        'total_pages': data.get('pagination', {}).get('total_pages', 1)
+    }
+
+def parse_search_target(url):
+    """('category', id) для URL категорії або ('search', text) для пошукового запиту"""
+    parsed_url = urllib.parse.urlparse(url)
+    if 'c' in parsed_url.path:  # Это категория, например /c80124/
+        category_match = re.search(r'/c(\d+)/', url)
+        if not category_match:
+            raise HTTPException(400, "Невірний URL категорії")
+        return 'category', category_match.group(1)
+    text = urllib.parse.parse_qs(parsed_url.query).get('text', [''])[0]
+    if not text:
+        raise HTTPException(400, "Не знайдено параметр 'text'")
+    return 'search', text
+
+async def run_search_job(params, progress, checkpoint=None):
+    session = http_client
+    target_kind, target = parse_search_target(params['url'])
+    if target_kind == 'category':
+        category_id = target
+        
+        async def category_page_ids(page):
+            return (await fetch_category_page(session, category_id, page))['product_ids']
+        
+        first_page = await fetch_category_page(session, category_id, 1)
+        total_pages = min(first_page['total_pages'], params['max_pages'])
+        id_source = iter_listing_ids(category_page_ids, first_page['product_ids'], total_pages, checkpoint)
+        expected_count = len(first_page['product_ids']) * total_pages
+        text = f"Категорія {category_id}"
+    else:
+        text = target
+        base_url = "https://search.rozetka.com.ua/ua/search/api/v7/?country=UA&lang=ua&text=" + urllib.parse.quote(text)
+        
+        async def search_page_ids(page):
+            data = await fetch_page(session, f"{base_url}&page={page}")
+            return [p.get('id') for p in data.get('goods', []) if p.get('id')]
+        
+        first_page = await fetch_page(session, f"{base_url}&page=1")
+        total_pages = min(first_page.get('pagination', {}).get('total_pages', 1), params['max_pages'])
+        first_page_ids = [p.get('id') for p in first_page.get('goods', []) if p.get('id')]
+        id_source = iter_listing_ids(search_page_ids, first_page_ids, total_pages, checkpoint)
+        expected_count = len(first_page_ids) * total_pages
+    
+    all_products = await run_pipeline(session, id_source, selenium_executor, params['include_chars'], "search",
+                                      params['extraction_engine'], progress,
+                                      params.get('delivery_city_id', DELIVERY_CITY_ID), expected_count, checkpoint)
+    
+    output_format = params.get('output_format', 'xlsx')
+    filename = f"downloads/rozetka_search_{text[:20].replace(' ', '_')}_{uuid.uuid4().hex[:8]}.{output_format}"
+    progress.emit('export', state='started')
+    await export_products(all_products, text, filename, params['include_chars'], "search", output_format)
+    progress.emit('export', state='finished')
+    return {"filename": os.path.basename(filename), "count": len(all_products)}
+
+async def run_seller_job(params, progress, checkpoint=None):
+    session = http_client
+    seller_name = params['seller_name']
+    
+    async def seller_page_ids(page):
+        return (await fetch_seller_api(session, seller_name, page))['product_ids']
+    
+    first_page = await fetch_seller_api(session, seller_name, 1)
+    seller_title = first_page['seller_title']
+    total_pages = min(first_page['total_pages'], params['max_pages'])
+    
+    logging.info(f"Продавець: {seller_title}, Парсимо перші {total_pages} сторінок, Перша сторінка: {len(first_page['product_ids'])} товарів")
+    
+    id_source = iter_listing_ids(seller_page_ids, first_page['product_ids'], total_pages, checkpoint)
+    all_products = await run_pipeline(session, id_source, selenium_executor, params['include_chars'], "seller",
+                                      params['extraction_engine'], progress,
+                                      params.get('delivery_city_id', DELIVERY_CITY_ID),
+                                      len(first_page['product_ids']) * total_pages, checkpoint)
+    
+    output_format = params.get('output_format', 'xlsx')
+    filename = f"downloads/rozetka_seller_{seller_name[:20].replace(' ', '_')}_{uuid.uuid4().hex[:8]}.{output_format}"
+    progress.emit('export', state='started')
+    await export_products(all_products, seller_title, filename, params['include_chars'], "seller", output_format)
+    progress.emit('export', state='finished')
+    return {"filename": os.path.basename(filename), "count": len(all_products)}
+
+async def run_favorites_job(params, progress, checkpoint=None):
+    session = http_client
+    name = params['name']
+    all_products = await run_pipeline(session, iter_id_list(params['product_ids']), selenium_executor, params['include_chars'],
+                                      "favorites", params['extraction_engine'], progress,
+                                      params.get('delivery_city_id', DELIVERY_CITY_ID), len(params['product_ids']),
+                                      checkpoint)
+    
+    output_format = params.get('output_format', 'xlsx')
+    if name == "Обрані товари":
+        filename = f"downloads/rozetka_favorites_{uuid.uuid4().hex[:8]}.{output_format}"
+    else:
+        filename = f"downloads/rozetka_{name.replace(' ', '_')}_{uuid.uuid4().hex[:8]}.{output_format}"
+    progress.emit('export', state='started')
+    await export_products(all_products, name, filename, params['include_chars'], "favorites", output_format)
+    progress.emit('export', state='finished')
+    return {"filename": os.path.basename(filename), "count": len(all_products)}
+
+JOB_RUNNERS = {
+    'search': run_search_job,
+    'seller': run_seller_job,
+    'favorites': run_favorites_job,
+}
 
 @app.post("/api/search")
 async def api_search(req: SearchRequest, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
     if not current_user:
         raise HTTPException(401, "Не авторизовано")
-    try:
-        parsed_url = urllib.parse.urlparse(req.url)
-        if 'c' in parsed_url.path:  # Это категория, например /c80124/
-            category_match = re.search(r'/c(\d+)/', req.url)
-            if category_match:
-                category_id = category_match.group(1)
-                session = cloudscraper.create_scraper()
-                session.headers.update(HEADERS)
-                
-                first_page = await fetch_category_page(session, category_id, 1)
-                total_pages = min(first_page['total_pages'], req.max_pages)
-                all_product_ids = first_page['product_ids']
-                
-                for page in range(2, total_pages + 1):
-                    page_data = await fetch_category_page(session, category_id, page)
-                    if not page_data['product_ids']:
-                        logging.warning(f"Сторінка {page} порожня, зупиняємо парсинг")
-                        break
-                    all_product_ids.extend(page_data['product_ids'])
-                    logging.info(f"Сторінка {page}/{total_pages}: зібрано {len(page_data['product_ids'])} товарів (всього: {len(all_product_ids)})")
-                
-                text = f"Категорія {category_id}"
-            else:
-                raise HTTPException(400, "Невірний URL категорії")
-        else:
-            query = parsed_url.query
-            text = urllib.parse.parse_qs(query).get('text', [''])[0]
-            if not text:
-                raise HTTPException(400, "Не знайдено параметр 'text'")
-            
-            base_url = "https://search.rozetka.com.ua/ua/search/api/v7/?country=UA&lang=ua&text=" + urllib.parse.quote(text)
-            
-            session = cloudscraper.create_scraper()
-            session.headers.update(HEADERS)
-            
-            data = await fetch_page(session, base_url)
-            total_pages = min(data.get('pagination', {}).get('total_pages', 1), req.max_pages)
-            all_product_ids = []
-            for page in range(1, total_pages + 1):
-                page_url = f"{base_url}&page={page}"
-                data = await fetch_page(session, page_url)
-                page_ids = [p.get('id') for p in data.get('goods', []) if p.get('id')]
-                if not page_ids:
-                    logging.warning(f"Сторінка {page} порожня, зупиняємо парсинг")
-                    break
-                all_product_ids.extend(page_ids)
-                logging.info(f"Сторінка {page}/{total_pages}: зібрано {len(page_ids)} товарів (всього: {len(all_product_ids)})")
-        
-        logging.info(f"Всього товарів: {len(all_product_ids)}")
-        
-        executor = ThreadPoolExecutor(max_workers=10)
-        all_products = []
-        
-        batch_size = 60
-        for i in range(0, len(all_product_ids), batch_size):
-            batch = all_product_ids[i:i + batch_size]
-            details = await fetch_details(session, batch)
-            tasks = [process_product(session, p, executor, req.include_chars, "search") for p in details]
-            batch_results = await asyncio.gather(*tasks)
-            all_products.extend(batch_results)
-        
-        executor.shutdown(wait=True)
-        
-        filename = f"downloads/rozetka_search_{text[:20].replace(' ', '_')}_{uuid.uuid4().hex[:8]}.xlsx"
-        await export_to_excel(all_products, text, filename, req.include_chars, "search")
-        
-        return {"filename": os.path.basename(filename), "count": len(all_products)}
-    except Exception as e:
-        logging.error(f"Помилка: {e}")
-        raise HTTPException(500, str(e))
+    parse_search_target(req.url)
+    check_output_format(req.output_format)
+    job_id = await job_manager.submit(current_user['username'], "search", req.model_dump())
+    return {"job_id": job_id}
 
 @app.post("/api/seller")
 async def api_seller(req: SellerRequest, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
     if not current_user:
         raise HTTPException(401, "Не авторизовано")
-    try:
-        async def fetch_seller_api(session, seller_name, page=1):
-            url = f"https://search.rozetka.com.ua/ua/seller/api/v7/?front-type=xl&country=UA&lang=ua&name={seller_name}&page={page}"
-            response = session.get(url, timeout=15)
-            response.raise_for_status()
-            await asyncio.sleep(random.uniform(0.1, 0.3))
-            data = response.json().get('data', {})
-            return {
-                'seller_title': data.get('seller_info', {}).get('title', ''),
-                'product_ids': [item.get('id') for item in data.get('goods', []) if item.get('id')],
-                'total_pages': data.get('pagination', {}).get('total_pages', 1)
-            }
-        
-        session = cloudscraper.create_scraper()
-        session.headers.update(HEADERS)
-        
-        first_page = await fetch_seller_api(session, req.seller_name, 1)
-        seller_title = first_page['seller_title']
-        total_pages = min(first_page['total_pages'], req.max_pages)
-        all_product_ids = first_page['product_ids']
-        
-        logging.info(f"Продавець: {seller_title}, Парсимо перші {total_pages} сторінок, Перша сторінка: {len(all_product_ids)} товарів")
-        
-        for page in range(2, total_pages + 1):
-            page_data = await fetch_seller_api(session, req.seller_name, page)
-            if not page_data['product_ids']:
-                logging.warning(f"Сторінка {page} порожня, зупиняємо парсинг")
-                break
-            all_product_ids.extend(page_data['product_ids'])
-            logging.info(f"Сторінка {page}/{total_pages}: зібрано {len(page_data['product_ids'])} товарів (всього: {len(all_product_ids)})")
-        
-        logging.info(f"Всього товарів: {len(all_product_ids)}")
-        
-        executor = ThreadPoolExecutor(max_workers=10)
-        all_products = []
-        
-        batch_size = 60
-        for i in range(0, len(all_product_ids), batch_size):
-            batch = all_product_ids[i:i + batch_size]
-            details = await fetch_details(session, batch)
-            tasks = [process_product(session, p, executor, req.include_chars, "s№eller") for p in details]
-            batch_results = await asyncio.gather(*tasks)
-            all_products.extend(batch_results)
-        
-        executor.shutdown(wait=True)
-        
-        filename = f"downloads/rozetka_seller_{req.seller_name[:20].replace(' ', '_')}_{uuid.uuid4().hex[:8]}.xlsx"
-        await export_to_excel(all_products, seller_title, filename, req.include_chars, "seller")
-        
-        return {"filename": os.path.basename(filename), "count": len(all_products)}
-    except Exception as e:
-        logging.error(f"Помилка: {e}")
-        raise HTTPException(500, str(e))
+    check_output_format(req.output_format)
+    job_id = await job_manager.submit(current_user['username'], "seller", req.model_dump())
+    return {"job_id": job_id}
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(401, "Не авторизовано")
+    job = await get_job(job_id)
+    if not job or job['username'] != current_user['username']:
+        raise HTTPException(404, "Задачу не знайдено")
+    return {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'state': job['state'],
+        'processed': job['processed'],
+        'total': job['total'],
+        'reenriched': job['reenriched'],
+        'reused': job['reused'],
+        'queue_position': job_manager.position(job_id),
+        'filename': job['filename'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+    }
+
+@app.post("/api/jobs/{job_id}/resume")
+async def resume_job(job_id: str, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(401, "Не авторизовано")
+    job = await get_job(job_id)
+    if not job or job['username'] != current_user['username']:
+        raise HTTPException(404, "Задачу не знайдено")
+    if job['state'] != 'failed':
+        raise HTTPException(409, "Відновити можна лише перервану задачу")
+    await job_manager.resume(job_id)
+    return {"job_id": job_id}
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events_stream(job_id: str, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(401, "Не авторизовано")
+    job = await get_job(job_id)
+    if not job or job['username'] != current_user['username']:
+        raise HTTPException(404, "Задачу не знайдено")
+    
+    async def stream():
+        subscriber = job_events.subscribe(job_id)
+        try:
+            job = await get_job(job_id)
+            yield f"data: {json.dumps({'stage': job['state'], 'processed': job['processed'], 'total': job['total'], 'filename': job['filename'], 'error': job['error'], 'queue_position': job_manager.position(job_id)})}\n\n"
+            if job['state'] in ('done', 'failed'):
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), JOB_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+                if event['stage'] in ('done', 'failed'):
+                    return
+        finally:
+            job_events.unsubscribe(job_id, subscriber)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.get("/api/cache/stats")
+async def cache_stats(current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(401, "Не авторизовано")
+    return {name: await asyncio.to_thread(cache.stats) for name, cache in cache_registry.items()}
+
+@app.get("/api/monitoring")
+async def monitoring(current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(401, "Не авторизовано")
+    return {
+        'executors': {pool.name: pool.stats() for pool in (io_executor, selenium_executor) if pool is not None},
+        'parse_processes': PARSE_PROCESSES if parse_executor is not None else 0,
+        'selenium_pool': selenium_pool.stats(),
+        'jobs': job_manager.stats(),
+        'admission': admission.stats(),
+        'rate_control': rate_controller.stats(),
+        'caches': {name: await asyncio.to_thread(cache.stats) for name, cache in cache_registry.items()},
+    }
 
 @app.get("/download/{filename}")
 async def download_file(filename: str, current_user: Optional[Dict[str, str]] = Depends(get_current_user)):
@@ -1567,7 +3467,8 @@ async def download_file(filename: str, current_user: Optional[Dict[str, str]] =
         raise HTTPException(401, "Не авторизовано")
     file_path = f"downloads/{filename}"
     if os.path.exists(file_path):
-        return FileResponse(file_path, filename=filename, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        media_type = EXPORT_MEDIA_TYPES.get(os.path.splitext(filename)[1].lstrip('.'), 'application/octet-stream')
+        return FileResponse(file_path, filename=filename, media_type=media_type)
     raise HTTPException(404, "Файл не знайдено")
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+"""Бенчмарк парсерів характеристик на збережених сторінках товарів.
+
+Запуск:
+    python bench_characteristics.py [pages/ ...] [--repeat 5] [--record]
+
+Без аргументів використовується fixtures/product_pages. Сторінки — основні сторінки товарів
+(product['href'], саме їх розбирає process_product), наприклад:
+    curl -sL https://rozetka.com.ua/ua/<slug>/p<id>/ -o pages/<id>.html
+
+Для кожної сторінки перевіряється, що всі бекенди з CHARS_PARSERS повертають той самий
+результат, що й еталонний bs4, а якщо в каталозі є expected.json — ще й записаний у ньому
+результат (--record перезаписує його еталонним). Далі друкується пропускна здатність кожного
+бекенду. Код виходу 1, якщо хоча б одна сторінка розійшлася.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from characteristics import CHARS_PARSERS
+
+REFERENCE = 'bs4'
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'product_pages')
+EXPECTED_FILE = 'expected.json'
+
+
+def load_pages(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.html'))))
+        else:
+            files.append(path)
+    pages = []
+    for file_path in files:
+        with open(file_path, encoding='utf-8') as f:
+            pages.append((file_path, f.read()))
+    return pages
+
+
+def load_expected(paths):
+    """Записані результати з expected.json у каталогах: шлях сторінки → (характеристики, гарантія)"""
+    expected = {}
+    for path in paths:
+        expected_path = os.path.join(path, EXPECTED_FILE)
+        if os.path.isdir(path) and os.path.exists(expected_path):
+            with open(expected_path, encoding='utf-8') as f:
+                for name, (characteristics, warranty) in json.load(f).items():
+                    expected[os.path.join(path, name)] = (characteristics, warranty)
+    return expected
+
+
+def record_expected(pages):
+    by_dir = {}
+    for file_path, html in pages:
+        by_dir.setdefault(os.path.dirname(file_path), {})[os.path.basename(file_path)] = CHARS_PARSERS[REFERENCE](html)
+    for path, results in by_dir.items():
+        with open(os.path.join(path, EXPECTED_FILE), 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Записано {len(results)} результатів у {os.path.join(path, EXPECTED_FILE)}")
+
+
+def check_identical(pages, recorded):
+    mismatches = 0
+    for file_path, html in pages:
+        reference = CHARS_PARSERS[REFERENCE](html)
+        mismatched = False
+        if file_path in recorded and reference != recorded[file_path]:
+            mismatched = True
+            print(f"РОЗБІЖНІСТЬ {REFERENCE} vs {EXPECTED_FILE}: {file_path}")
+        for name, parser in CHARS_PARSERS.items():
+            if name != REFERENCE and parser(html) != reference:
+                mismatched = True
+                print(f"РОЗБІЖНІСТЬ {name} vs {REFERENCE}: {file_path}")
+        mismatches += mismatched
+    return mismatches
+
+
+def bench(pages, repeat):
+    total_bytes = sum(len(html) for _, html in pages)
+    results = {}
+    for name, parser in CHARS_PARSERS.items():
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for _, html in pages:
+                parser(html)
+        elapsed = time.perf_counter() - started
+        results[name] = elapsed
+        count = len(pages) * repeat
+        print(f"{name:>6}: {count / elapsed:8.1f} стор/с  {total_bytes * repeat / elapsed / 1e6:7.2f} МБ/с  "
+              f"{elapsed / count * 1000:7.2f} мс/стор")
+    if REFERENCE in results:
+        for name, elapsed in results.items():
+            if name != REFERENCE:
+                print(f"{name} швидший за {REFERENCE} у {results[REFERENCE] / elapsed:.1f} раз(и)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк парсерів характеристик")
+    parser.add_argument('paths', nargs='*', default=[FIXTURES_DIR], help="HTML файли або каталоги з *.html")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--record', action='store_true', help=f"записати результати {REFERENCE} у {EXPECTED_FILE}")
+    args = parser.parse_args()
+
+    pages = load_pages(args.paths)
+    if not pages:
+        print("Не знайдено жодної сторінки")
+        return 1
+    print(f"Сторінок: {len(pages)}, {sum(len(h) for _, h in pages) / 1e6:.2f} МБ")
+    if args.record:
+        record_expected(pages)
+    mismatches = check_identical(pages, load_expected(args.paths))
+    print(f"Ідентичні результати: {len(pages) - mismatches}/{len(pages)}")
+    bench(pages, args.repeat)
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
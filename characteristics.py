@@ -0,0 +1,86 @@
+"""Парсери характеристик і гарантії з HTML сторінки товару Rozetka.
+
+Модуль не має побічних ефектів при імпорті (без БД, кешів і мережі), тому його використовують
+і app.py, і bench_characteristics.py. 'bs4' — еталон: повне дерево сторінки; 'fast' — у дерево
+потрапляють лише блоки <dl> та div-и гарантії, а результат має збігатися з еталоном.
+"""
+import re
+
+from bs4 import BeautifulSoup
+
+
+def _soup_characteristics(soup):
+    characteristics = {}
+    char_lists = soup.find_all('dl', class_='list')
+    for char_list in char_lists:
+        items = char_list.find_all('div', class_='item')
+        for item in items:
+            label_elem = item.find('dt', class_='label')
+            value_elem = item.find('dd', class_='value')
+            if label_elem and value_elem:
+                label = label_elem.get_text(strip=True)
+                values = []
+                sub_list = value_elem.find('ul', class_='sub-list')
+                if sub_list:
+                    for li in sub_list.find_all('li'):
+                        link = li.find('a')
+                        text = link.get_text(strip=True) if link else li.get_text(strip=True)
+                        if text:
+                            values.append(text)
+                if values:
+                    characteristics[label] = ', '.join(values)
+    warranty_div = soup.find('div', {'rzhasoverflow': True, 'class': lambda x: x and 'flex-1' in x})
+    warranty = warranty_div.get_text(strip=True).replace('\xa0', ' ') if warranty_div else ''
+    return characteristics, warranty
+
+
+def parse_characteristics_bs4(html: str):
+    """Еталонний парсер: повне дерево сторінки через BeautifulSoup"""
+    return _soup_characteristics(BeautifulSoup(html, 'html.parser'))
+
+
+# Коментарі та вміст <script>/<style> html.parser не вважає тегами, тож сканер їх пропускає
+SKIPPED_MARKUP = r'<!--.*?-->|<(?P<raw>script|style)\b.*?</(?P=raw)\s*>'
+CHARS_SECTION_START_RE = re.compile(
+    SKIPPED_MARKUP + r'|<(?P<tag>dl)\b[^>]*>|<(?P<warranty>div)\b[^>]*?\brzhasoverflow\b[^>]*>', re.I | re.S)
+ELEMENT_TAG_RES = {
+    tag: re.compile(SKIPPED_MARKUP + rf'|<(?P<closing>/?){tag}\b(?P<attrs>[^>]*)>', re.I | re.S)
+    for tag in ('dl', 'div')
+}
+
+
+def _element_end(html, start, tag):
+    """Позиція після закриваючого тегу елемента, що починається в start (з урахуванням вкладеності)"""
+    depth = 0
+    for match in ELEMENT_TAG_RES[tag].finditer(html, start):
+        if match.group('raw') is not None or match.group(0).startswith('<!--'):
+            continue
+        if match.group('closing'):
+            depth -= 1
+        elif not match.group('attrs').rstrip().endswith('/'):
+            depth += 1
+        if depth == 0:
+            return match.end()
+    return len(html)
+
+
+def parse_characteristics_fast(html: str):
+    """Цільовий парсер: у дерево потрапляють лише блоки <dl> та div-и гарантії, решта сторінки пропускається"""
+    fragments = []
+    position = 0
+    while match := CHARS_SECTION_START_RE.search(html, position):
+        tag = match.group('tag') or match.group('warranty')
+        if tag is None:
+            position = match.end()
+            continue
+        position = _element_end(html, match.start(), tag.lower())
+        fragments.append(html[match.start():position])
+    if not fragments:
+        return {}, ''
+    return _soup_characteristics(BeautifulSoup(''.join(fragments), 'html.parser'))
+
+
+CHARS_PARSERS = {
+    'fast': parse_characteristics_fast,
+    'bs4': parse_characteristics_bs4,
+}